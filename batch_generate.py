@@ -0,0 +1,332 @@
+# Headless batch generation of proposals for many client/project pairs
+#
+#   python batch_generate.py --csv capture_export.csv --out proposals/
+#   python batch_generate.py --snowflake --pairs pairs.csv --out proposals/ --rpm 60 --tpm 80000
+#
+# Credentials are read from .streamlit/secrets.toml (same keys as the app); environment
+# variables with the same names take precedence. Finished proposals are recorded in
+# <out>/manifest.jsonl and skipped on the next run, so an interrupted batch can be resumed.
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+import pandas as pd
+from openai import AsyncAzureOpenAI
+
+from capture_data import (build_prompt_data, capture_index, capture_rows, fetch_prompt_data, list_client_projects,
+                          read_capture_csv)
+from completion_cache import CompletionCache
+from proposal_core import generate_proposal
+from resilient_llm import ResilientCaller
+from telemetry import configure_logging, metrics
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+SETTING_KEYS = [
+    "OPENAI_API_KEY", "OPENAI_API_VERSION", "OPENAI_API_ENDPOINT",
+    "SNOWFLAKE_USER", "SNOWFLAKE_PASSWORD", "SNOWFLAKE_ACCOUNT",
+    "SNOWFLAKE_WAREHOUSE", "SNOWFLAKE_DATABASE", "SNOWFLAKE_SCHEMA",
+    "COMPLETION_CACHE_PATH",
+]
+
+# Function to load the app settings from the secrets file and the environment
+def load_settings(path=SECRETS_PATH):
+    settings = {}
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            settings.update(tomllib.load(f))
+    for key in SETTING_KEYS:
+        if key in os.environ:
+            settings[key] = os.environ[key]
+    return settings
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    # Seconds until `amount` can be taken (requests larger than the bucket wait for a full bucket)
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / self.refill_per_second
+
+
+# Token-bucket scheduler for the Azure OpenAI requests-per-minute and tokens-per-minute quotas
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute, expected_completion_tokens=1500):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.expected_completion_tokens = expected_completion_tokens
+        self.tokens_used = 0
+        self._lock = asyncio.Lock()
+
+    # Callers queue on the lock, so requests are admitted in arrival order
+    async def acquire(self, tokens):
+        async with self._lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= min(tokens, self.tokens.capacity)
+                    self.tokens_used += tokens
+                    return
+                await asyncio.sleep(wait)
+
+    # Correct the estimate taken in acquire() once the response reports real usage
+    def record_usage(self, estimated_tokens, actual_tokens):
+        self.tokens.level -= actual_tokens - estimated_tokens
+        self.tokens_used += actual_tokens - estimated_tokens
+
+
+# Function to turn a client/project pair into a file name: a readable prefix plus a hash of the
+# exact parts, so pairs that normalise alike never share files, checkpoints or manifest entries
+def slugify(*parts):
+    text = "-".join(str(part) for part in parts)
+    readable = re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-").lower()[:80] or "proposal"
+    digest = hashlib.sha256(json.dumps([str(part) for part in parts]).encode("utf-8")).hexdigest()[:10]
+    return f"{readable}-{digest}"
+
+# Function to read (client, project) pairs from a CSV with CLIENT and PROJECT_NAME columns
+def read_pairs(path):
+    pairs = pd.read_csv(path, usecols=["CLIENT", "PROJECT_NAME"], dtype=str)
+    return list(pairs.drop_duplicates().itertuples(index=False, name=None))
+
+# Function to render the generated markdown as a Word document
+def write_docx(markdown, path):
+    from docx import Document
+
+    document = Document()
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        heading = re.match(r"^(#{1,6})\s+(.*)$", stripped)
+        if heading:
+            document.add_heading(heading.group(2).strip("* "), level=min(len(heading.group(1)), 4))
+            continue
+        if re.match(r"^[-*]\s+", stripped):
+            paragraph = document.add_paragraph(style="List Bullet")
+            stripped = re.sub(r"^[-*]\s+", "", stripped)
+        elif re.match(r"^\d+[.)]\s+", stripped):
+            paragraph = document.add_paragraph(style="List Number")
+            stripped = re.sub(r"^\d+[.)]\s+", "", stripped)
+        else:
+            paragraph = document.add_paragraph()
+        # **bold** spans become bold runs
+        for i, text in enumerate(re.split(r"\*\*", stripped)):
+            if text:
+                paragraph.add_run(text).bold = i % 2 == 1
+    document.save(path)
+
+# Function to read the pairs already finished by a previous run
+def load_manifest(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry.get("status") == "done":
+                        done[entry["slug"]] = entry
+    return done
+
+
+class BatchRunner:
+    def __init__(self, args, settings):
+        self.args = args
+        self.settings = settings
+        self.out_dir = args.out
+        self.manifest_path = os.path.join(self.out_dir, "manifest.jsonl")
+        self.cache = CompletionCache(settings.get("COMPLETION_CACHE_PATH", os.path.join(".cache", "completions.sqlite3")))
+        self.limiter = RateLimiter(args.rpm, args.tpm, args.expected_completion_tokens)
+        self.caller = ResilientCaller(deadline_seconds=args.deadline, hedge=args.hedge)
+        self.checkpoint_dir = os.path.join(self.out_dir, ".checkpoints")
+        self.snowflake_pool = None
+        self.capture = None
+        self.results = {"done": 0, "failed": 0, "skipped": 0}
+        self._manifest_lock = asyncio.Lock()
+
+        if args.csv:
+            self.capture = read_capture_csv(args.csv)
+        else:
+            from snowflake_pool import SnowflakePool
+            self.snowflake_pool = SnowflakePool(
+                dict(
+                    user=settings["SNOWFLAKE_USER"],
+                    password=settings["SNOWFLAKE_PASSWORD"],
+                    account=settings["SNOWFLAKE_ACCOUNT"],
+                    warehouse=settings["SNOWFLAKE_WAREHOUSE"],
+                    database=settings["SNOWFLAKE_DATABASE"],
+                    schema=settings["SNOWFLAKE_SCHEMA"],
+                ),
+                max_size=args.concurrency,
+            )
+
+    def list_pairs(self):
+        if self.args.pairs:
+            return read_pairs(self.args.pairs)
+        if self.capture is not None:
+            return [(client_name, project_name) for client_name, projects in capture_index(self.capture).items()
+                    for project_name in projects]
+        with self.snowflake_pool.connection() as conn:
+            return list(dict.fromkeys(list_client_projects(conn)))
+
+    # Runs in a worker thread: both sources are blocking
+    def load_prompt_data(self, client_name, project_name):
+        if self.capture is not None:
+            return build_prompt_data(capture_rows(self.capture, client_name, project_name))
+        with self.snowflake_pool.connection() as conn:
+            return fetch_prompt_data(conn, client_name, project_name)
+
+    async def record(self, entry):
+        async with self._manifest_lock:
+            with open(self.manifest_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    # Sections finished before a failure are kept on disk so the next run resumes from them
+    def load_checkpoint(self, slug):
+        path = os.path.join(self.checkpoint_dir, f"{slug}.json")
+        if self.args.force or not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def save_checkpoint(self, slug, checkpoint):
+        path = os.path.join(self.checkpoint_dir, f"{slug}.json")
+        if checkpoint:
+            with open(path, "w") as f:
+                json.dump(checkpoint, f)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    async def generate_one(self, async_client, slots, client_name, project_name):
+        slug = slugify(client_name, project_name)
+        async with slots:
+            start = time.perf_counter()
+            checkpoint = self.load_checkpoint(slug)
+            try:
+                prompt_data = await asyncio.to_thread(self.load_prompt_data, client_name, project_name)
+                if prompt_data is None:
+                    raise ValueError("no capture rows found")
+
+                result = await generate_proposal(
+                    async_client, prompt_data, self.args.part2_concurrency,
+                    self.cache, force=self.args.force, limiter=self.limiter,
+                    caller=self.caller, checkpoint=checkpoint,
+                )
+
+                markdown = f"# {client_name}: {project_name}\n\n{result['full_proposal']}\n"
+                markdown_path = os.path.join(self.out_dir, f"{slug}.md")
+                with open(markdown_path, "w") as f:
+                    f.write(markdown)
+                docx_path = os.path.join(self.out_dir, f"{slug}.docx")
+                await asyncio.to_thread(write_docx, markdown, docx_path)
+            except Exception as e:
+                self.save_checkpoint(slug, checkpoint)
+                self.results["failed"] += 1
+                print(f"FAILED  {client_name} / {project_name}: {e}")
+                await self.record({"slug": slug, "client": client_name, "project": project_name,
+                                   "status": "failed", "error": str(e)})
+                return
+
+            self.save_checkpoint(slug, {})
+            seconds = time.perf_counter() - start
+            self.results["done"] += 1
+            print(f"done    {client_name} / {project_name} in {seconds:.1f}s")
+            await self.record({"slug": slug, "client": client_name, "project": project_name, "status": "done",
+                               "seconds": round(seconds, 2), "markdown": markdown_path, "docx": docx_path,
+                               "prompt_tokens": {part: report["total"] for part, report in result["tokens"].items()}})
+
+    async def run(self):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        finished = {} if self.args.force else load_manifest(self.manifest_path)
+
+        pending = []
+        for client_name, project_name in self.list_pairs():
+            slug = slugify(client_name, project_name)
+            if slug in finished and os.path.exists(finished[slug]["markdown"]):
+                self.results["skipped"] += 1
+                continue
+            pending.append((client_name, project_name))
+        print(f"{len(pending)} proposals to generate, {self.results['skipped']} already done")
+
+        slots = asyncio.Semaphore(self.args.concurrency)
+        start = time.perf_counter()
+        async with AsyncAzureOpenAI(
+            api_key=self.settings["OPENAI_API_KEY"],
+            api_version=self.settings["OPENAI_API_VERSION"],
+            azure_endpoint=self.settings["OPENAI_API_ENDPOINT"],
+            timeout=self.args.deadline,
+            max_retries=0,  # retries are handled by ResilientCaller
+        ) as async_client:
+            await asyncio.gather(*(
+                self.generate_one(async_client, slots, client_name, project_name)
+                for client_name, project_name in pending
+            ))
+        elapsed = time.perf_counter() - start
+
+        if self.snowflake_pool is not None:
+            self.snowflake_pool.close()
+        if self.args.metrics_file:
+            metrics.dump(self.args.metrics_file)
+        self.report(elapsed)
+
+    def report(self, elapsed):
+        minutes = max(elapsed, 1e-9) / 60
+        print()
+        print(f"Generated {self.results['done']} proposals in {elapsed:.1f}s "
+              f"({self.results['failed']} failed, {self.results['skipped']} skipped)")
+        print(f"Throughput: {self.results['done'] / minutes:.2f} proposals/min, "
+              f"{self.limiter.tokens_used / minutes:.0f} tokens/min")
+        print(f"Completion cache: {self.cache.hits} hits, {self.cache.misses} misses")
+        print(f"LLM calls: {self.caller.retries} retries, {self.caller.hedges} hedged")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate proposals for many client/project pairs.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="Capture form export holding one or more client/project pairs")
+    source.add_argument("--snowflake", action="store_true", help="Read capture forms from CAPTURED_PROPOSAL_DATA")
+    parser.add_argument("--pairs", help="CSV of CLIENT,PROJECT_NAME pairs to generate (default: every pair in the source)")
+    parser.add_argument("--out", default="proposals", help="Output directory for .md/.docx files and the manifest")
+    parser.add_argument("--concurrency", type=int, default=3, help="Proposals generated at the same time")
+    parser.add_argument("--part2-concurrency", type=int, default=4, help="Part 2 sections generated in parallel per proposal")
+    parser.add_argument("--rpm", type=int, default=60, help="Azure OpenAI requests-per-minute quota")
+    parser.add_argument("--tpm", type=int, default=80_000, help="Azure OpenAI tokens-per-minute quota")
+    parser.add_argument("--expected-completion-tokens", type=int, default=1500,
+                        help="Completion tokens reserved per request before the real usage is known")
+    parser.add_argument("--deadline", type=float, default=180, help="Seconds allowed for each completion before it is retried")
+    parser.add_argument("--hedge", action="store_true", help="Send a duplicate request when a call runs past the p95 latency")
+    parser.add_argument("--force", action="store_true", help="Regenerate everything, ignoring the manifest and cache")
+    parser.add_argument("--metrics-file", help="Write per-stage timings in Prometheus text format when the batch ends")
+    parser.add_argument("--log-spans", action="store_true", help="Emit a JSON log line for every timed stage")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help="Path to the Streamlit secrets file")
+    args = parser.parse_args()
+
+    if args.log_spans:
+        configure_logging()
+    runner = BatchRunner(args, load_settings(args.secrets))
+    asyncio.run(runner.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# Offline end-to-end benchmark of proposal generation
+#
+#   python benchmarks/bench_e2e.py --forms 12 --rows 400 --runs 5 --json results/e2e.json
+#   python benchmarks/bench_e2e.py --ttft 0.8 --tokens-per-second 40 --throttle-rate 0.1 --json slow.json
+#
+# Needs no credentials or network: Azure OpenAI is replaced by benchmarks/fake_openai.py (started
+# in a child process unless --openai-url is given) and CAPTURED_PROPOSAL_DATA by a seeded SQLite
+# file. Two flows are measured:
+#   single  the app's path: capture rows -> prompt_data -> streamed Part 1 and Part 2 sections
+#   multi   batch_generate's BatchRunner over every seeded form
+# Results are written as JSON (--json) so runs can be compared.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from openai import AsyncAzureOpenAI
+
+from batch_generate import BatchRunner, load_manifest
+from capture_data import build_prompt_data, fetch_capture_rows, list_client_projects
+from fake_snowflake import FakeSnowflakePool, seed_capture_table
+from proposal_core import PART1_KEY, generate_proposal
+from resilient_llm import ResilientCaller
+from telemetry import metrics, span
+
+API_VERSION = "2024-02-01"
+
+# Function to start the fake endpoint in its own interpreter so it does not share the driver's GIL
+def start_fake_server(args):
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"), "--port", "0",
+        "--ttft", str(args.ttft), "--tokens-per-second", str(args.tokens_per_second),
+        "--completion-tokens", str(args.completion_tokens), "--throttle-rate", str(args.throttle_rate),
+        "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    if not line.startswith("listening "):
+        process.kill()
+        raise RuntimeError(f"fake OpenAI server failed to start: {line!r}")
+    return process, line.split(" ", 1)[1]
+
+def server_stats(url):
+    import urllib.request
+
+    with urllib.request.urlopen(f"{url}/stats", timeout=5) as response:
+        return json.load(response)
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "p50": ordered[int(0.50 * (len(ordered) - 1))],
+        "p95": ordered[int(0.95 * (len(ordered) - 1))],
+        "mean": statistics.fmean(ordered),
+        "max": ordered[-1],
+    }
+
+def make_client(url, deadline):
+    return AsyncAzureOpenAI(api_key="offline", api_version=API_VERSION, azure_endpoint=url, timeout=deadline, max_retries=0)
+
+# One proposal the way main() builds it, with streaming on; time-to-first-token is taken per section
+async def single_run(url, pool, client_name, project_name, args):
+    first_token = {}
+    start = time.perf_counter()
+
+    def on_update(key, text):
+        first_token.setdefault(key, time.perf_counter() - start)
+
+    with pool.connection() as conn, span("snowflake.capture_query"):
+        rows = fetch_capture_rows(conn, client_name, project_name)
+    with span("prompt.assembly", rows=len(rows)):
+        prompt_data = build_prompt_data(rows)
+
+    async with make_client(url, args.deadline) as async_client:
+        result = await generate_proposal(
+            async_client, prompt_data, args.part2_concurrency, on_update=on_update,
+            caller=ResilientCaller(deadline_seconds=args.deadline),
+        )
+    elapsed = time.perf_counter() - start
+
+    return {
+        "client": client_name,
+        "project": project_name,
+        "capture_rows": len(rows),
+        "e2e_s": elapsed,
+        "ttft_s": first_token.get(PART1_KEY),
+        "section_ttft_s": first_token,
+        "prompt_tokens": {part: report["total"] for part, report in result["tokens"].items()},
+        "prompt_tokens_total": sum(report["total"] for report in result["tokens"].values()),
+        "completion_chars": len(result["full_proposal"]),
+    }
+
+def single_flow(url, pool, pairs, args):
+    runs = []
+    for i in range(args.runs):
+        client_name, project_name = pairs[i % len(pairs)]
+        run = asyncio.run(single_run(url, pool, client_name, project_name, args))
+        runs.append(run)
+        print(f"single  {client_name} / {project_name}: {run['e2e_s']:.2f}s, first token {run['ttft_s']:.2f}s")
+    return {
+        "runs": runs,
+        "e2e_s": percentiles([run["e2e_s"] for run in runs]),
+        "ttft_s": percentiles([run["ttft_s"] for run in runs if run["ttft_s"] is not None]),
+        "prompt_tokens_total": percentiles([run["prompt_tokens_total"] for run in runs]),
+    }
+
+# Every seeded form through BatchRunner, reading the same rows exported as a capture CSV
+def multi_flow(url, pool, pairs, workdir, args):
+    csv_path = os.path.join(workdir, "capture_export.csv")
+    with pool.connection() as conn, conn.cursor() as cur:
+        capture = cur.execute("SELECT * FROM CAPTURED_PROPOSAL_DATA").fetch_pandas_all()
+    capture.rename(columns={"SESSION_ID": "SESSION ID"}).to_csv(csv_path, index=False)
+
+    batch_args = SimpleNamespace(
+        csv=csv_path, snowflake=False, pairs=None, out=os.path.join(workdir, "proposals"),
+        concurrency=args.concurrency, part2_concurrency=args.part2_concurrency, rpm=args.rpm, tpm=args.tpm,
+        expected_completion_tokens=args.completion_tokens, deadline=args.deadline, hedge=args.hedge,
+        force=True, metrics_file=None, log_spans=False,
+    )
+    settings = {
+        "OPENAI_API_KEY": "offline", "OPENAI_API_VERSION": API_VERSION, "OPENAI_API_ENDPOINT": url,
+        "COMPLETION_CACHE_PATH": os.path.join(workdir, "completions.sqlite3"),
+    }
+    os.makedirs(batch_args.out, exist_ok=True)
+    runner = BatchRunner(batch_args, settings)
+
+    start = time.perf_counter()
+    asyncio.run(runner.run())
+    elapsed = time.perf_counter() - start
+
+    manifest = load_manifest(runner.manifest_path).values()
+    minutes = elapsed / 60
+    return {
+        "proposals": len(pairs),
+        "done": runner.results["done"],
+        "failed": runner.results["failed"],
+        "elapsed_s": elapsed,
+        "proposals_per_min": runner.results["done"] / minutes,
+        "tokens_per_min": runner.limiter.tokens_used / minutes,
+        "retries": runner.caller.retries,
+        "proposal_s": percentiles([entry["seconds"] for entry in manifest]),
+        "prompt_tokens_total": percentiles([sum(entry["prompt_tokens"].values()) for entry in manifest]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with local OpenAI and Snowflake stand-ins")
+    parser.add_argument("--flows", nargs="+", choices=["single", "multi"], default=["single", "multi"])
+    parser.add_argument("--forms", type=int, default=6, help="Synthetic capture forms seeded into the table")
+    parser.add_argument("--rows", type=int, default=200, help="Capture rows per form")
+    parser.add_argument("--runs", type=int, default=3, help="Proposals generated one at a time in the single flow")
+    parser.add_argument("--concurrency", type=int, default=3, help="Proposals in flight in the multi flow")
+    parser.add_argument("--part2-concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=1_000_000)
+    parser.add_argument("--deadline", type=float, default=60)
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--openai-url", help="Use an already running fake (or real) endpoint instead of starting one")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Fake server: seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="Fake server: streaming rate")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="Fake server: words per completion")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fake server: share of requests answered 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    # Local servers must not be sent through a proxy
+    os.environ["NO_PROXY"] = ",".join(filter(None, [os.environ.get("NO_PROXY"), "127.0.0.1", "localhost"]))
+
+    process = None
+    url = args.openai_url
+    if url is None:
+        process, url = start_fake_server(args)
+
+    results = {"config": vars(args), "openai_url": url}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            db_path = os.path.join(workdir, "capture.sqlite3")
+            start = time.perf_counter()
+            pairs = seed_capture_table(db_path, args.forms, args.rows, seed=args.seed)
+            results["seed_s"] = time.perf_counter() - start
+            pool = FakeSnowflakePool(db_path)
+
+            with pool.connection() as conn, span("snowflake.picker_query"):
+                results["picker_pairs"] = len(list_client_projects(conn, "consultant@example.com"))
+
+            if "single" in args.flows:
+                results["single"] = single_flow(url, pool, pairs, args)
+            if "multi" in args.flows:
+                results["multi"] = multi_flow(url, pool, pairs, workdir, args)
+
+        results["stages"] = metrics.summary()
+        if process is not None:
+            results["server"] = server_stats(url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print()
+    if "single" in results:
+        single = results["single"]
+        print(f"single: e2e p50 {single['e2e_s']['p50']:.2f}s p95 {single['e2e_s']['p95']:.2f}s, "
+              f"first token p50 {single['ttft_s']['p50']:.2f}s, prompt tokens p50 {single['prompt_tokens_total']['p50']:.0f}")
+    if "multi" in results:
+        multi = results["multi"]
+        print(f"multi:  {multi['done']}/{multi['proposals']} proposals in {multi['elapsed_s']:.1f}s "
+              f"({multi['proposals_per_min']:.1f}/min, {multi['tokens_per_min']:.0f} tokens/min, {multi['retries']} retries)")
+    if "server" in results:
+        print(f"server: {results['server']}")
+
+    if args.json:
+        directory = os.path.dirname(args.json)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Micro-benchmark for building prompt_data from synthetic capture forms
+#
+#   python benchmarks/bench_prompt_data.py --sizes 10000 100000 1000000
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_data import build_prompt_data, cached_prompt_data, read_capture_csv
+
+CATEGORIES = ['Solutions Aspect', 'Key Challenges', 'Additional Info', 'Timeline', 'Budget']
+IMPORTANCES = ['High', 'Moderate', 'Low']
+
+# Function to generate a capture form with the same columns as the CSV export
+def synthetic_capture(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CLIENT': 'Acme Corp',
+        'PROJECT_NAME': 'Data Platform Modernisation',
+        'SOLUTION': 'ILA',
+        'CATEGORY': rng.choice(CATEGORIES, rows),
+        'SUB_CATEGORY': pd.Series(rng.integers(0, 50, rows)).map(lambda i: f"Topic {i}"),
+        'IMPORTANCE': rng.choice(IMPORTANCES, rows),
+        'USER_INPUT': pd.Series(rng.integers(0, 10_000, rows)).map(lambda i: f"Captured answer number {i}"),
+        'KEY': np.arange(rows),
+        'USER_ID': 'consultant@example.com',
+        'SESSION ID': 'session-1',
+        'DATE_LOADED': '2024-01-01',
+    })
+
+# The row-wise implementation that used to run inside main()
+def legacy_prompt_data(df):
+    df = df.copy()
+    df['SOLUTION'] = df['SOLUTION'].replace(to_replace='ILA', value='Information Landscape Assessment')
+    Solution = df['SOLUTION'].drop_duplicates().iloc[0]
+    Project = df['PROJECT_NAME'].drop_duplicates().iloc[0]
+    client_name = df['CLIENT'].drop_duplicates().iloc[0]
+
+    def lines(rows):
+        return '\n'.join(rows.apply(lambda row: f"{row['SUB_CATEGORY']}: {row['USER_INPUT']}", axis=1))
+
+    key_challenges = df[df['CATEGORY'] == 'Key Challenges']
+    return {
+        'Client_Name': client_name,
+        'Project_Name': Project,
+        'Solution': Solution,
+        'Key_challenges_high': lines(key_challenges[key_challenges['IMPORTANCE'] == 'High']),
+        'Key_challenges_medium': lines(key_challenges[key_challenges['IMPORTANCE'] == 'Moderate']),
+        'Key_challenges_low': lines(key_challenges[key_challenges['IMPORTANCE'] == 'Low']),
+        'Solution_aspect': lines(df[df['CATEGORY'] == 'Solutions Aspect']),
+        'Additional_info': '\n'.join(df[df['CATEGORY'] == 'Additional Info']['USER_INPUT']),
+    }
+
+# Function to check blank SUB_CATEGORY/USER_INPUT cells, both as None from Snowflake and as empty CSV cells.
+# Blanks now render as empty text, so the legacy path is given the same frame with blanks filled in.
+def check_blank_cells(rows=2_000):
+    df = synthetic_capture(rows).astype({'SUB_CATEGORY': object, 'USER_INPUT': object})
+    df.loc[df.index % 7 == 0, 'SUB_CATEGORY'] = None
+    df.loc[df.index % 5 == 0, 'USER_INPUT'] = np.nan
+    expected = legacy_prompt_data(df.fillna({'SUB_CATEGORY': '', 'USER_INPUT': ''}))
+    assert build_prompt_data(df) == expected, "blank cells from Snowflake differ from the legacy implementation"
+
+    csv = io.BytesIO(df.to_csv(index=False).encode('utf-8'))
+    assert build_prompt_data(read_capture_csv(csv)) == expected, "blank CSV cells differ from the legacy implementation"
+    print(f"blank cells: {rows} rows match the legacy implementation")
+
+def best_of(repeats, fn, *args):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt_data extraction")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--skip-legacy-above', type=int, default=1_000_000,
+                        help="Skip the row-wise implementation for larger frames")
+    args = parser.parse_args()
+
+    check_blank_cells()
+    print(f"{'rows':>10} {'legacy (s)':>12} {'vectorized (s)':>15} {'memoized (s)':>13} {'speedup':>8}")
+    for rows in args.sizes:
+        df = synthetic_capture(rows)
+
+        vectorized, result = best_of(args.repeats, build_prompt_data, df)
+        cached_prompt_data(df)
+        memoized, _ = best_of(args.repeats, cached_prompt_data, df)
+
+        if rows <= args.skip_legacy_above:
+            legacy, expected = best_of(1, legacy_prompt_data, df)
+            assert result == expected, "vectorized prompt_data differs from the legacy implementation"
+            print(f"{rows:>10} {legacy:>12.3f} {vectorized:>15.3f} {memoized:>13.4f} {legacy / vectorized:>7.1f}x")
+        else:
+            print(f"{rows:>10} {'-':>12} {vectorized:>15.3f} {memoized:>13.4f} {'-':>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Startup benchmark: time-to-first-paint of the login page
+#
+# Each run starts a fresh interpreter and renders the app with Streamlit's AppTest as an
+# unauthenticated visitor, timing the cold first run (imports included) and a warm rerun.
+# Compare against an older revision by exporting it next to the current script:
+#
+#   git show <rev>:proposal_generate.py > proposal_generate_before.py
+#   python benchmarks/bench_startup.py --script proposal_generate_before.py --script proposal_generate.py
+#
+# Secrets come from .streamlit/secrets.toml when present, otherwise placeholders are used
+# (enough for the login page once resources are lazy; eager versions fail and are reported).
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRETS_PATH = os.path.join(ROOT, ".streamlit", "secrets.toml")
+PLACEHOLDER_SECRETS = [
+    "OPENAI_API_KEY", "OPENAI_API_VERSION", "OPENAI_API_ENDPOINT", "CLIENT_ID", "CLIENT_SECRET", "TENANT_ID",
+    "SNOWFLAKE_USER", "SNOWFLAKE_PASSWORD", "SNOWFLAKE_ACCOUNT", "SNOWFLAKE_WAREHOUSE", "SNOWFLAKE_DATABASE",
+    "SNOWFLAKE_SCHEMA",
+]
+
+# Function run in the child interpreter: render the login page twice and report the timings
+def measure(script, timeout):
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_seconds = time.perf_counter() - start
+
+    secrets = {key: f"placeholder-{key.lower()}" for key in PLACEHOLDER_SECRETS}
+    secrets["OPENAI_API_ENDPOINT"] = "https://placeholder.openai.azure.com/"
+    if os.path.exists(SECRETS_PATH):
+        import tomllib
+        with open(SECRETS_PATH, "rb") as f:
+            secrets.update(tomllib.load(f))
+
+    app = AppTest.from_file(script, default_timeout=timeout)
+    for key, value in secrets.items():
+        app.secrets[key] = value
+
+    start = time.perf_counter()
+    app.run()
+    first_paint = time.perf_counter() - start
+
+    start = time.perf_counter()
+    app.run()
+    rerun = time.perf_counter() - start
+
+    errors = [str(exception.value) for exception in app.exception]
+    return {
+        "streamlit_import_s": import_seconds,
+        "first_paint_s": first_paint,
+        "rerun_s": rerun,
+        "login_button": any(button.label == "Login with Azure AD" for button in app.get("link_button")),
+        "errors": errors,
+    }
+
+def run_child(script, timeout):
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", script, "--timeout", str(timeout)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark time-to-first-paint of the login page")
+    parser.add_argument("--script", action="append", help="App script to measure (repeatable)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per script")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="Write the raw results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.timeout)))
+        return
+
+    scripts = args.script or [os.path.join(ROOT, "proposal_generate.py")]
+    results = {}
+    for script in scripts:
+        runs = [run_child(os.path.abspath(script), args.timeout) for _ in range(args.runs)]
+        results[script] = runs
+        first = [run["first_paint_s"] for run in runs]
+        rerun = [run["rerun_s"] for run in runs]
+        errors = sorted({error for run in runs for error in run["errors"]})
+        print(f"{script}")
+        print(f"  first paint: median {statistics.median(first):.3f}s  min {min(first):.3f}s")
+        print(f"  rerun:       median {statistics.median(rerun):.3f}s  min {min(rerun):.3f}s")
+        print(f"  login button rendered: {all(run['login_button'] for run in runs)}")
+        for error in errors:
+            print(f"  error: {error[:200]}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
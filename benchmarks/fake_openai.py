@@ -0,0 +1,161 @@
+# Local stand-in for the Azure OpenAI chat completions endpoint, for offline benchmarks
+#
+#   python benchmarks/fake_openai.py --port 8765 --ttft 0.4 --tokens-per-second 60 --throttle-rate 0.05
+#
+# Answers any POST path ending in /chat/completions (Azure deployment URLs included), with or
+# without stream=true. Latency is a time-to-first-token plus a fixed token rate, and a share of
+# requests can be rejected with 429 and a Retry-After header. GET /stats returns request counts.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the client data platform governance pipeline landscape assessment roadmap quality "
+         "integration reporting stakeholders migration security analytics ownership").split()
+
+
+class FakeOpenAIConfig:
+    def __init__(self, ttft=0.3, tokens_per_second=80, completion_tokens=400, throttle_rate=0.0,
+                 retry_after_ms=250, seed=None):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "streamed": 0, "throttled": 0, "completion_tokens": 0}
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def should_throttle(self):
+        with self.lock:
+            return self.random.random() < self.throttle_rate
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as with the real endpoint
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/stats":
+            self.send_error(404)
+            return
+        with self.config.lock:
+            self.send_json(200, dict(self.config.stats))
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        config = self.config
+        config.count("requests")
+        if config.should_throttle():
+            config.count("throttled")
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+                           {"retry-after-ms": str(config.retry_after_ms), "retry-after": str(max(1, config.retry_after_ms // 1000))})
+            return
+
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4 + 1
+        words = [config.random.choice(WORDS) for _ in range(config.completion_tokens)]
+        model = body.get("model", "gpt-4")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        config.count("completion_tokens", len(words))
+
+        time.sleep(config.ttft)
+        if body.get("stream"):
+            config.count("streamed")
+            self.stream(completion_id, model, words)
+        else:
+            time.sleep(len(words) / config.tokens_per_second)
+            self.send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                          "total_tokens": prompt_tokens + len(words)},
+            })
+
+    # Server-sent events over chunked transfer encoding, one word per chunk
+    def stream(self, completion_id, model, words):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1 / self.config.tokens_per_second
+        for i, word in enumerate(words):
+            self.write_chunk("data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": word if i == 0 else " " + word}}],
+            }) + "\n\n")
+            time.sleep(interval)
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to start the fake endpoint on a daemon thread; port 0 picks a free port
+def start_fake_openai(config, port=0, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="0 picks a free port")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--completion-tokens", type=int, default=400, help="Words returned per completion")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests rejected with 429")
+    parser.add_argument("--retry-after-ms", type=int, default=250)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(args.ttft, args.tokens_per_second, args.completion_tokens, args.throttle_rate,
+                              args.retry_after_ms, args.seed)
+    server = start_fake_openai(config, args.port, args.host)
+    # The driver reads this line to find the port
+    print(f"listening http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# SQLite stand-in for CAPTURED_PROPOSAL_DATA, for offline benchmarks
+#
+# Wraps sqlite3 with the parts of the Snowflake connector the app uses: cursors as context
+# managers, pyformat parameters (%(name)s) and fetch_pandas_all. Only portable SQL runs here,
+# so the capture-row query and list_client_projects work but the LISTAGG prompt query does not.
+import os
+import re
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_prompt_data import synthetic_capture
+
+CAPTURE_TABLE_COLUMNS = ['CLIENT', 'PROJECT_NAME', 'SOLUTION', 'CATEGORY', 'SUB_CATEGORY', 'IMPORTANCE', 'USER_INPUT',
+                         'KEY', 'USER_ID', 'SESSION_ID', 'DATE_LOADED']
+
+PYFORMAT_PARAMETER = re.compile(r"%\((\w+)\)s")
+
+
+class FakeCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, sql, params=None):
+        self._cursor.execute(PYFORMAT_PARAMETER.sub(r":\1", sql), params or {})
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetch_pandas_all(self):
+        columns = [column[0] for column in self._cursor.description]
+        return pd.DataFrame(self._cursor.fetchall(), columns=columns)
+
+    def close(self):
+        self._cursor.close()
+
+
+class FakeConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return FakeCursor(self._conn.cursor())
+
+    def is_closed(self):
+        return self._conn is None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# Same connection() interface as SnowflakePool; SQLite connections are cheap, so none are kept
+class FakeSnowflakePool:
+    def __init__(self, path):
+        self.path = path
+        self.checkouts = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            self.checkouts += 1
+        conn = FakeConnection(self.path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+# Function to create CAPTURED_PROPOSAL_DATA and fill it with synthetic capture forms
+def seed_capture_table(path, forms, rows_per_form, user_id='consultant@example.com', seed=0):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("DROP TABLE IF EXISTS CAPTURED_PROPOSAL_DATA")
+        conn.execute(f"CREATE TABLE CAPTURED_PROPOSAL_DATA ({', '.join(CAPTURE_TABLE_COLUMNS)})")
+        pairs = []
+        for form in range(forms):
+            client_name, project_name = f"Client {form // 3 + 1:03d}", f"Project {form % 3 + 1}"
+            capture = synthetic_capture(rows_per_form, seed=seed + form)
+            capture['CLIENT'] = client_name
+            capture['PROJECT_NAME'] = project_name
+            capture['USER_ID'] = user_id
+            capture['SESSION ID'] = f"session-{form}"
+            capture = capture.rename(columns={'SESSION ID': 'SESSION_ID'})[CAPTURE_TABLE_COLUMNS]
+            conn.executemany(
+                f"INSERT INTO CAPTURED_PROPOSAL_DATA VALUES ({', '.join('?' * len(CAPTURE_TABLE_COLUMNS))})",
+                capture.astype(object).itertuples(index=False, name=None),
+            )
+            pairs.append((client_name, project_name))
+        conn.execute("CREATE INDEX capture_pair ON CAPTURED_PROPOSAL_DATA (CLIENT, PROJECT_NAME)")
+        conn.commit()
+    finally:
+        conn.close()
+    return pairs
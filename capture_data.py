@@ -0,0 +1,270 @@
+# Capture form helpers that do not depend on Streamlit
+import hashlib
+import importlib.util
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from telemetry import metrics, span
+
+# Columns read when turning capture rows into prompt fields
+PROMPT_COLUMNS = ['CLIENT', 'PROJECT_NAME', 'SOLUTION', 'CATEGORY', 'SUB_CATEGORY', 'IMPORTANCE', 'USER_INPUT']
+
+SOLUTION_NAMES = {'ILA': 'Information Landscape Assessment'}
+
+# Dtypes the prompt columns of an export are read with; the repetitive ones are categorical
+CATEGORICAL_COLUMNS = ['SOLUTION', 'CATEGORY', 'IMPORTANCE']
+CAPTURE_DTYPES = {column: 'category' if column in CATEGORICAL_COLUMNS else 'string' for column in PROMPT_COLUMNS}
+
+# Exports larger than this are streamed in chunks instead of parsed in one go
+CSV_CHUNK_BYTES = 64 * 1024 * 1024
+CSV_CHUNK_ROWS = 100_000
+
+# Prompt fields built from capture rows, with the rows that feed each of them
+PROMPT_FIELD_RULES = [
+    ('Solution_aspect', 'Solutions Aspect', None),
+    ('Key_challenges_high', 'Key Challenges', 'High'),
+    ('Key_challenges_medium', 'Key Challenges', 'Moderate'),
+    ('Key_challenges_low', 'Key Challenges', 'Low'),
+    ('Additional_info', 'Additional Info', None),
+]
+
+# Function to build prompt_data from capture rows in a single grouped pass
+def build_prompt_data(df):
+    if df.empty:
+        return None
+
+    category = df['CATEGORY'].astype(object)
+    importance = df['IMPORTANCE'].astype(object)
+    conditions = []
+    for _, rule_category, rule_importance in PROMPT_FIELD_RULES:
+        condition = category == rule_category
+        if rule_importance is not None:
+            condition &= importance == rule_importance
+        conditions.append(condition.to_numpy())
+    field = np.select(conditions, [name for name, _, _ in PROMPT_FIELD_RULES], default='')
+
+    # Additional info rows are used as-is, every other field is "SUB_CATEGORY: USER_INPUT";
+    # blank cells render as empty text, matching COALESCE(..., '') in fetch_prompt_data
+    used = df[field != '']
+    field = field[field != '']
+    user_input = used['USER_INPUT'].astype(object).fillna('').astype(str)
+    sub_category = used['SUB_CATEGORY'].astype(object).fillna('').astype(str)
+    lines = user_input.where(field == 'Additional_info', sub_category + ': ' + user_input)
+    joined = lines.groupby(field, sort=False).agg('\n'.join)
+
+    solution = df['SOLUTION'].iloc[0]
+    prompt_data = {
+        'Client_Name': df['CLIENT'].iloc[0],
+        'Project_Name': df['PROJECT_NAME'].iloc[0],
+        'Solution': SOLUTION_NAMES.get(solution, solution),
+    }
+    for name in ['Key_challenges_high', 'Key_challenges_medium', 'Key_challenges_low', 'Solution_aspect', 'Additional_info']:
+        prompt_data[name] = joined.get(name, '')
+    return prompt_data
+
+# Function to hash the prompt columns of a capture DataFrame
+def capture_fingerprint(df):
+    columns = [column for column in PROMPT_COLUMNS if column in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    digest = hashlib.sha256(hashes.to_numpy().tobytes())
+    digest.update('|'.join(columns).encode('utf-8'))
+    return digest.hexdigest()
+
+# Shared by every Streamlit session in the process
+_prompt_data_memo = OrderedDict()
+_prompt_data_lock = threading.Lock()
+PROMPT_DATA_MEMO_SIZE = 16
+
+# Function to build prompt_data, recomputing only when the capture rows change
+def cached_prompt_data(df):
+    key = capture_fingerprint(df)
+    with _prompt_data_lock:
+        prompt_data = _prompt_data_memo.get(key)
+        if prompt_data is not None:
+            _prompt_data_memo.move_to_end(key)
+    # Memo hits are only counted; the prompt.assembly span times real builds
+    metrics.increment("prompt_data_memo_hits" if prompt_data is not None else "prompt_data_memo_misses")
+
+    if prompt_data is None:
+        with span("prompt.assembly", rows=len(df)):
+            prompt_data = build_prompt_data(df)
+        with _prompt_data_lock:
+            _prompt_data_memo[key] = prompt_data
+            if len(_prompt_data_memo) > PROMPT_DATA_MEMO_SIZE:
+                _prompt_data_memo.popitem(last=False)
+
+    return dict(prompt_data) if prompt_data is not None else None
+
+# pyarrow parses multi-threaded; it ships with Streamlit but is not guaranteed elsewhere
+def csv_engine():
+    return 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+# Function to measure an uploaded file or a path without reading it
+def _source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    size = getattr(source, 'size', None)
+    if size is None and hasattr(source, 'seek'):
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END)
+        source.seek(position)
+    return size or 0
+
+# Function to check an export by column name; raises ValueError naming the missing columns
+def validate_capture_columns(columns):
+    missing = [column for column in PROMPT_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"The CSV is missing required column(s): {', '.join(missing)}")
+
+# Function to replace solution codes with their full names without decoding the categorical column
+def _expand_solution_names(solution):
+    names = {code: SOLUTION_NAMES.get(code, code) for code in solution.cat.categories}
+    if len(set(names.values())) == len(names):
+        return solution.cat.rename_categories(names)
+    return solution.astype(object).replace(SOLUTION_NAMES).astype('category')
+
+# Function to read a capture form export, keeping only the prompt columns with compact dtypes
+def read_capture_csv(source, chunk_bytes=CSV_CHUNK_BYTES, chunk_rows=CSV_CHUNK_ROWS):
+    header = pd.read_csv(source, nrows=0)
+    validate_capture_columns(header.columns)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    if _source_size(source) <= chunk_bytes:
+        df = pd.read_csv(source, usecols=PROMPT_COLUMNS, dtype=CAPTURE_DTYPES, engine=csv_engine())
+    else:
+        # The pyarrow engine cannot stream, so large files go through the C parser chunk by chunk
+        # Categoricals are encoded per chunk from string columns so their categories always share a dtype
+        reader = pd.read_csv(source, usecols=PROMPT_COLUMNS, dtype='string', chunksize=chunk_rows)
+        chunks = [chunk.astype({column: 'category' for column in CATEGORICAL_COLUMNS}) for chunk in reader]
+        if not chunks:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in CAPTURE_DTYPES.items()})
+        categoricals = {
+            column: pd.api.types.union_categoricals([chunk[column] for chunk in chunks])
+            for column in CATEGORICAL_COLUMNS
+        }
+        df = pd.concat([chunk.drop(columns=CATEGORICAL_COLUMNS) for chunk in chunks], ignore_index=True)
+        for column, values in categoricals.items():
+            df[column] = values
+
+    df = df[PROMPT_COLUMNS]
+    df['SOLUTION'] = _expand_solution_names(df['SOLUTION'])
+    return df
+
+# Function to map each client in an export to its projects, like the Snowflake picker
+def capture_index(df):
+    pairs = df[['CLIENT', 'PROJECT_NAME']].dropna().drop_duplicates()
+    pairs = pairs[pairs['CLIENT'] != '']
+    index = {}
+    for client_name, project_name in pairs.itertuples(index=False, name=None):
+        index.setdefault(client_name, []).append(project_name)
+    return dict(sorted(index.items()))
+
+# Function to select the capture rows of one client/project pair
+def capture_rows(df, client_name, project_name):
+    rows = df[(df['CLIENT'] == client_name) & (df['PROJECT_NAME'] == project_name)]
+    return rows.reset_index(drop=True)
+
+# Function to list the (client, project) pairs with captured data, optionally for one user
+def list_client_projects(conn, user_id=None):
+    with conn.cursor() as cur:
+        if user_id is not None:
+            sql_query = """
+                WITH details AS (
+                    SELECT DISTINCT CLIENT, PROJECT_NAME, SESSION_ID 
+                    FROM CAPTURED_PROPOSAL_DATA
+                    WHERE USER_ID = %(user_id)s
+                )
+                SELECT CLIENT, PROJECT_NAME 
+                FROM details 
+                WHERE CLIENT != '' 
+                ORDER BY CLIENT;
+            """
+            cur.execute(sql_query, {'user_id': user_id})
+        else:
+            sql_query = """
+                WITH details AS (
+                    SELECT DISTINCT CLIENT, PROJECT_NAME, SESSION_ID 
+                    FROM CAPTURED_PROPOSAL_DATA
+                )
+                SELECT CLIENT, PROJECT_NAME 
+                FROM details 
+                WHERE CLIENT != '' 
+                ORDER BY CLIENT;
+            """
+            cur.execute(sql_query)
+
+        return cur.fetchall()
+
+# Capture rows are read in a fixed order so both query modes join lines identically
+CAPTURE_ROW_ORDER = "DATE_LOADED, KEY"
+
+# Function to read every capture row of one client/project pair
+def fetch_capture_rows(conn, client_name, project_name):
+    sql = f"""
+        SELECT *
+        FROM CAPTURED_PROPOSAL_DATA
+        WHERE client = %(client_name)s AND project_name = %(project_name)s
+        ORDER BY {CAPTURE_ROW_ORDER};
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, {'client_name': client_name, 'project_name': project_name})
+        return cur.fetch_pandas_all()
+
+# Function to assemble the prompt fields inside Snowflake and return them as a single row
+#
+# Meant to match build_prompt_data(fetch_capture_rows(...)), but no test or benchmark runs this
+# query: the SQLite stand-in in benchmarks/ has no LISTAGG or IFF. Check any change to it against
+# build_prompt_data on a real warehouse.
+def fetch_prompt_data(conn, client_name, project_name):
+    sql = f"""
+        WITH capture AS (
+            SELECT CLIENT, PROJECT_NAME, SOLUTION, CATEGORY, SUB_CATEGORY, IMPORTANCE, USER_INPUT, DATE_LOADED, KEY
+            FROM CAPTURED_PROPOSAL_DATA
+            WHERE client = %(client_name)s AND project_name = %(project_name)s
+        ),
+        fields AS (
+            SELECT
+                IFF(CATEGORY = 'Key Challenges', CATEGORY || ' ' || IMPORTANCE, CATEGORY) AS FIELD,
+                -- NULL cells become empty text so LISTAGG keeps the row, as build_prompt_data does
+                LISTAGG(IFF(CATEGORY = 'Additional Info', COALESCE(USER_INPUT, ''),
+                            COALESCE(SUB_CATEGORY, '') || ': ' || COALESCE(USER_INPUT, '')), '\\n')
+                    WITHIN GROUP (ORDER BY {CAPTURE_ROW_ORDER}) AS TEXT
+            FROM capture
+            WHERE CATEGORY IN ('Solutions Aspect', 'Key Challenges', 'Additional Info')
+            GROUP BY FIELD
+        ),
+        header AS (
+            -- The first row's values, NULLs included, as build_prompt_data takes them with iloc[0]
+            SELECT CLIENT AS CLIENT_NAME, PROJECT_NAME, SOLUTION
+            FROM capture
+            ORDER BY {CAPTURE_ROW_ORDER}
+            LIMIT 1
+        )
+        SELECT
+            h.CLIENT_NAME,
+            h.PROJECT_NAME,
+            IFF(h.SOLUTION = 'ILA', 'Information Landscape Assessment', h.SOLUTION),
+            COALESCE(MAX(IFF(f.FIELD = 'Key Challenges High', f.TEXT, NULL)), ''),
+            COALESCE(MAX(IFF(f.FIELD = 'Key Challenges Moderate', f.TEXT, NULL)), ''),
+            COALESCE(MAX(IFF(f.FIELD = 'Key Challenges Low', f.TEXT, NULL)), ''),
+            COALESCE(MAX(IFF(f.FIELD = 'Solutions Aspect', f.TEXT, NULL)), ''),
+            COALESCE(MAX(IFF(f.FIELD = 'Additional Info', f.TEXT, NULL)), '')
+        FROM header h
+        LEFT JOIN fields f ON TRUE
+        GROUP BY h.CLIENT_NAME, h.PROJECT_NAME, h.SOLUTION;
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, {'client_name': client_name, 'project_name': project_name})
+        row = cur.fetchone()
+
+    if row is None or row[0] is None:
+        return None
+
+    keys = ['Client_Name', 'Project_Name', 'Solution', 'Key_challenges_high', 'Key_challenges_medium',
+            'Key_challenges_low', 'Solution_aspect', 'Additional_info']
+    return dict(zip(keys, row))
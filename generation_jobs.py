@@ -0,0 +1,142 @@
+# Background proposal generation shared by every Streamlit session in the process
+#
+# Jobs run on a small thread pool so an in-flight generation survives reruns of the page that
+# started it; pages poll a job's snapshot instead of holding a script thread for minutes.
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import metrics, span
+
+# Finished jobs are kept this long so a page can still pick up the result
+FINISHED_JOB_TTL_SECONDS = 3600
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class GenerationJob:
+    def __init__(self, job_id, owner, sections, checkpoint):
+        self.id = job_id
+        self.owner = owner
+        self.status = "queued"  # queued -> running -> done | failed
+        self.section_status = {key: "pending" for key in sections}
+        self.text = {}
+        self.checkpoint = checkpoint
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    # Passed to generate_proposal as on_update; streamed text ends with a cursor until the section is final
+    def on_update(self, key, text):
+        with self._lock:
+            self.text[key] = text
+            self.section_status[key] = "streaming" if text.endswith("▌") else "done"
+
+    # Passed to generate_proposal as on_done, so status advances whether or not text is streamed
+    def mark_done(self, key):
+        with self._lock:
+            self.section_status[key] = "done"
+
+    def finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    # Consistent copy for rendering; the worker keeps updating the job meanwhile
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "section_status": dict(self.section_status),
+                "text": dict(self.text),
+                "result": self.result,
+                "error": self.error,
+                "checkpoint": dict(self.checkpoint),
+                "submitted_at": self.submitted_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    def __init__(self, max_workers=4, max_queued=16):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        # Bounds running plus queued jobs; ThreadPoolExecutor's own queue is unbounded
+        self._capacity = threading.BoundedSemaphore(max_workers + max_queued)
+        self._jobs = {}  # owner -> latest job
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # run(job) does the generation in the worker thread and returns its result; it reports progress
+    # through job.on_update / job.mark_done and records finished sections in job.checkpoint.
+    # An owner has at most one unfinished job; submitting again returns that job.
+    def submit(self, owner, run, sections, checkpoint=None):
+        with self._lock:
+            self._expire()
+            current = self._jobs.get(owner)
+            if current is not None and not current.finished:
+                return current
+            if not self._capacity.acquire(blocking=False):
+                metrics.increment("jobs_rejected")
+                raise JobQueueFull(f"{self.max_workers + self.max_queued} generations are already queued or running")
+            job = GenerationJob(next(self._ids), owner, sections, dict(checkpoint or {}))
+            self._jobs[owner] = job
+        metrics.increment("jobs_submitted")
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job, run):
+        job.started_at = time.time()
+        job.status = "running"
+        metrics.observe("job.queue_wait", job.started_at - job.submitted_at)
+        try:
+            with span("job.run", job=job.id):
+                result = run(job)
+        except Exception as e:
+            job.finish("failed", error=str(e))
+            metrics.increment("jobs_failed")
+        else:
+            job.finish("done", result=result)
+        finally:
+            self._capacity.release()
+
+    def get(self, owner):
+        with self._lock:
+            return self._jobs.get(owner)
+
+    # Drops the owner's job once its result has been taken over by the page
+    def discard(self, owner, job_id):
+        with self._lock:
+            job = self._jobs.get(owner)
+            if job is not None and job.id == job_id and job.finished:
+                del self._jobs[owner]
+
+    def _expire(self):
+        cutoff = time.time() - FINISHED_JOB_TTL_SECONDS
+        for owner, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[owner]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(job.status == "queued" for job in jobs),
+            "running": sum(job.status == "running" for job in jobs),
+            "workers": self.max_workers,
+        }
@@ -0,0 +1,390 @@
+# Proposal prompts and generation shared by the Streamlit app and the batch runner
+import asyncio
+import hashlib
+
+from resilient_llm import default_caller
+from telemetry import metrics, span
+from token_budget import PromptTooLarge, count_message_tokens, count_tokens, fit_to_budget, token_report
+
+# System Message for OpenAI (Unchanged)
+SYSTEM_MESSAGE =  """
+You are an experienced proposal writer for Decision Inc, tasked with generating professional, comprehensive, and persuasive proposal documentation for clients.
+Your goal is to create an in-depth proposal based on the provided context, tailored specifically to the client's needs.
+Ensure coherence, professionalism, and persuasive language throughout the proposal.
+Avoid unnecessary content like company letterheads, greetings, signatures, or repetitive information.
+Write in a professional and formal tone suitable for a high-stakes project proposal from a leading data consultancy to an important client.
+Your writing should be detailed, insightful, and demonstrate a deep understanding of the client's challenges and how our solutions can address them.
+"""
+
+# Model settings shared by both parts of the proposal
+MODEL = "gpt-4"
+TEMPERATURE = 0.7
+
+# gpt-4 has an 8k context window shared by the prompt and the completion
+CONTEXT_WINDOW_TOKENS = 8192
+COMPLETION_RESERVE_TOKENS = 2500
+MAX_PROMPT_TOKENS = CONTEXT_WINDOW_TOKENS - COMPLETION_RESERVE_TOKENS
+
+# prompt_data fields rendered into each part's prompt
+PART1_FIELDS = ['Client_Name', 'Project_Name', 'Solution', 'Key_challenges_high', 'Key_challenges_medium',
+                'Key_challenges_low', 'Solution_aspect', 'Additional_info']
+PART2_FIELDS = ['Client_Name', 'Project_Name', 'Solution', 'Solution_aspect']
+CHALLENGE_FIELDS = ['Key_challenges_high', 'Key_challenges_medium', 'Key_challenges_low']
+
+# Part 1 is generated as a single completion, Part 2 one completion per section
+PART1_KEY = "Part 1"
+PART1_DIGEST_CHARS = 1500
+
+# Define sections and their overviews (Unchanged)
+SECTIONS_PART1 = ['Executive Summary', 'Client Background and Problem Statement']
+SECTIONS_PART2 = ['Solution Overview', 'Scope of Work', 'Proposed Enabling Technology', 'Statement of Work']
+
+# Units generated by one completion each, with the prompt_data fields they depend on. Part 2
+# sections read the challenges through a digest of Part 1; the Solution Overview answers them
+# directly, so a challenge edit regenerates it with Part 1. Each Part 2 section also records
+# which Part 1 it was built from (see outdated_sections).
+SECTION_DEPENDENCIES = {
+    PART1_KEY: PART1_FIELDS,
+    **{section: PART2_FIELDS for section in SECTIONS_PART2},
+    'Solution Overview': PART2_FIELDS + CHALLENGE_FIELDS,
+}
+
+SECTION_OVERVIEWS = {
+    'Executive Summary': (
+        "Provide a detailed introduction to the client's situation, including their industry, market position, and key challenges. "
+        "Explain how our solution addresses their needs and the anticipated benefits. "
+        "Highlight the unique value proposition and why we are the best choice for this project."
+    ),
+    'Client Background and Problem Statement': (
+        "Thoroughly describe the client's background, including their history, mission, and strategic objectives. "
+        "Detail the specific challenges they are facing, supported by data or examples where possible. "
+        "Explain how these challenges impact their business operations and strategic goals."
+    ),
+    'Solution Overview': (
+        "Present an in-depth outline of the proposed solution. "
+        "Explain the methodology, processes, and technologies involved. "
+        "Illustrate how the solution addresses each of the client's challenges, and include case studies or success stories from similar projects."
+    ),
+    'Scope of Work': (
+        "Detail all tasks, deliverables, and methodologies required to implement the solution. "
+        "Break down the project phases, timelines, and resource allocations. "
+        "Include responsibilities, milestones, and key performance indicators (KPIs) to measure success."
+    ),
+    'Proposed Enabling Technology': (
+        "Discuss in detail the technology stack that will support the proposed solution. "
+        "Explain why these technologies are the best fit for the client’s needs. "
+        "Include technical specifications, integration strategies, and how the technology aligns with the client's existing systems."
+    ),
+    'Statement of Work': (
+        "Summarize the formal terms of the proposal, including all deliverables, detailed timelines, pricing structures, payment schedules, and expected outcomes. "
+        "Outline the terms and conditions, acceptance criteria, and any assumptions or dependencies. "
+        "Ensure clarity to avoid any ambiguities regarding project execution."
+    )
+}
+
+# Function to process data into a dictionary (Unchanged)
+def process_data(rows):
+    data = {}
+    for row in rows:
+        client_name, project = row
+        if client_name in data:
+            data[client_name].append(project)
+        else:
+            data[client_name] = [project]
+    return data
+
+# Function to build prompts (Unchanged)
+def build_prompt_part1(prompt_data, sections, section_overviews):
+    # Concisely format the prompt data
+    prompt_data_text = f"""
+Client Name: {prompt_data['Client_Name']}
+Project Name: {prompt_data['Project_Name']}
+Solution: {prompt_data['Solution']}
+Key Challenges - High Importance: {prompt_data['Key_challenges_high']}
+Key Challenges - Medium Importance: {prompt_data['Key_challenges_medium']}
+Key Challenges - Low Importance: {prompt_data['Key_challenges_low']}
+Solution Aspects: {prompt_data['Solution_aspect']}
+Additional Information: {prompt_data['Additional_info']}
+"""
+
+    # Build the instructions for the first set of sections
+    sections_text = ""
+    for section in sections:
+        sections_text += f"### {section}\n{section_overviews[section]}\n\n"
+
+    # Build the full prompt for part 1
+    full_prompt = f"""
+Use the following client information to inform your writing:
+{prompt_data_text}
+
+Please generate a comprehensive, detailed, and in-depth proposal with the following sections:
+
+{sections_text}
+
+Each section should be extensive and provide substantial information, insights, and analysis. Use professional language, and ensure the proposal is coherent and flows logically from one section to the next. Include relevant examples, data, and references where appropriate to support the content.
+"""
+    return full_prompt
+
+def build_prompt_part2(prompt_data, previous_content, sections, section_overviews):
+    # Build the instructions for the remaining sections
+    sections_text = ""
+    for section in sections:
+        sections_text += f"### {section}\n{section_overviews[section]}\n\n"
+
+    # Build the full prompt for part 2
+    # SYSTEM_MESSAGE is sent as the system message, so it is not repeated here
+    full_prompt = f"""
+Use the following client information to inform your writing:
+Client Name: {prompt_data['Client_Name']}
+Project Name: {prompt_data['Project_Name']}
+Solution: {prompt_data['Solution']}
+Solution Aspects: {prompt_data['Solution_aspect']}
+
+Previously generated content:
+{previous_content}
+
+Please continue generating the proposal with the following sections:
+
+{sections_text}
+
+Each section should be extensive and provide substantial information, insights, and analysis. Ensure coherence with the previous sections and maintain a consistent professional tone. Use relevant examples, data, and references where appropriate to support the content.
+"""
+    return full_prompt
+
+# Function to condense Part 1 into a short digest shared by every Part 2 section
+def digest_part1(content, max_chars=PART1_DIGEST_CHARS):
+    # Keep each heading and the first paragraph written under it
+    digest = []
+    take_paragraph = True
+    for block in content.split("\n\n"):
+        block = block.strip()
+        if not block:
+            continue
+        if block.startswith("#"):
+            heading, _, body = block.partition("\n")
+            digest.append(heading)
+            take_paragraph = True
+            block = body.strip()
+            if not block:
+                continue
+        if take_paragraph:
+            digest.append(block)
+            take_paragraph = False
+
+    digest_text = "\n\n".join(digest)
+    if len(digest_text) > max_chars:
+        digest_text = digest_text[:max_chars].rsplit(" ", 1)[0] + " ..."
+    return digest_text
+
+# Function to wrap a prompt in the chat messages sent to the model
+def build_messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+
+# Function to build the Part 1 prompt within the token budget, with its token report
+def budget_prompt_part1(prompt_data, max_tokens=MAX_PROMPT_TOKENS):
+    render = lambda fields, _: build_messages(build_prompt_part1(fields, SECTIONS_PART1, SECTION_OVERVIEWS))
+    fields, _, trimmed = fit_to_budget(prompt_data, '', render, max_tokens, MODEL)
+    messages = render(fields, '')
+    report = token_report(messages, {field: str(fields[field]) for field in PART1_FIELDS}, trimmed, MODEL, max_tokens)
+    return messages[1]["content"], report
+
+# Function to build a Part 2 section prompt within the token budget, with its token report
+def budget_prompt_part2(prompt_data, previous_content, section, max_tokens=MAX_PROMPT_TOKENS):
+    render = lambda fields, previous: build_messages(build_prompt_part2(fields, previous, [section], SECTION_OVERVIEWS))
+    fields, previous, trimmed = fit_to_budget(prompt_data, previous_content, render, max_tokens, MODEL)
+    messages = render(fields, previous)
+    components = {field: str(fields[field]) for field in PART2_FIELDS}
+    components['previous_content'] = previous
+    report = token_report(messages, components, trimmed, MODEL, max_tokens)
+    return messages[1]["content"], report
+
+# Function to refuse a prompt that trimming could not bring within the budget
+def check_budget(key, report):
+    if report['over_budget']:
+        raise PromptTooLarge(f"The {key} prompt needs {report['total']} tokens but the budget is {report['budget']}; "
+                             "shorten the high priority challenges or the solution aspects in the capture form")
+
+# Function to snapshot the prompt_data fields a unit was generated from
+def section_inputs(prompt_data, key):
+    return {field: prompt_data.get(field) for field in SECTION_DEPENDENCIES[key]}
+
+# Function to list the units whose inputs changed since `previous` was generated
+def stale_sections(previous, prompt_data):
+    if previous is None:
+        return list(SECTION_DEPENDENCIES)
+    generated_from = previous.get("section_inputs", {})
+    return [key for key in SECTION_DEPENDENCIES if generated_from.get(key) != section_inputs(prompt_data, key)]
+
+# Function to fingerprint the Part 1 digest a Part 2 prompt was built around
+def digest_hash(part1_digest):
+    return hashlib.sha256(part1_digest.encode("utf-8")).hexdigest()[:16]
+
+# Function to list the Part 2 sections of a result that were built from an older Part 1
+def outdated_sections(result):
+    current = result.get("part1_digest")
+    built_from = result.get("part2_built_from", {})
+    return [section for section in SECTIONS_PART2 if current and built_from.get(section) != current]
+
+# Function to generate independent prompts concurrently, one completion per prompt
+#
+# Each call goes through `caller` (deadline, retries, optional hedging). Finished sections are
+# recorded in `checkpoint`, keyed by section with the prompt they were generated from, so a
+# failed run can be resumed without regenerating the sections that already succeeded.
+async def generate_sections(async_client, prompts, concurrency, cache=None, on_update=None, force=False,
+                            limiter=None, caller=None, checkpoint=None, on_done=None):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    caller = caller or default_caller
+
+    async def reserve(messages):
+        if limiter is None:
+            return None
+        estimated_tokens = count_message_tokens(messages, MODEL) + limiter.expected_completion_tokens
+        await limiter.acquire(estimated_tokens)
+        return estimated_tokens
+
+    async def request_completion(messages, attributes):
+        estimated_tokens = await reserve(messages)
+        response = await async_client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+        )
+        if response.usage is not None:
+            attributes["completion_tokens"] = response.usage.completion_tokens
+            if limiter is not None:
+                limiter.record_usage(estimated_tokens, response.usage.total_tokens)
+        return response.choices[0].message.content.strip()
+
+    async def request_stream(section, messages, attributes):
+        await reserve(messages)
+        response = await async_client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            stream=True,
+        )
+        content = ""
+        async for chunk in response:
+            # Azure sends chunks without choices (e.g. content filter results) which carry no text
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                content += delta
+                on_update(section, content + "▌")
+        content = content.strip()
+        on_update(section, content)
+        attributes["completion_tokens"] = count_tokens(content, MODEL)
+        return content
+
+    async def generate(section, prompt):
+        saved = checkpoint.get(section) if checkpoint is not None else None
+        if saved is not None and saved["prompt"] == prompt:
+            metrics.increment("checkpoint_hits")
+            if on_update is not None:
+                on_update(section, saved["content"])
+            if on_done is not None:
+                on_done(section)
+            return saved["content"]
+
+        messages = build_messages(prompt)
+        cache_key = None
+        content = None
+        if cache is not None:
+            cache_key = cache.make_key(MODEL, TEMPERATURE, messages)
+            if not force:
+                content = cache.get(cache_key)
+                metrics.increment("completion_cache_hits" if content is not None else "completion_cache_misses")
+                if content is not None and on_update is not None:
+                    on_update(section, content)
+
+        if content is None:
+            async with semaphore:
+                stage = "llm.part1" if section == PART1_KEY else "llm.part2"
+                with span(stage, section=section, prompt_tokens=count_message_tokens(messages, MODEL)) as attributes:
+                    if on_update is None:
+                        content = await caller.call(lambda: request_completion(messages, attributes))
+                    else:
+                        # Streams are never hedged: two streams would render into the same placeholder
+                        content = await caller.call(lambda: request_stream(section, messages, attributes), hedge=False)
+                metrics.increment("prompt_tokens", attributes["prompt_tokens"])
+                metrics.increment("completion_tokens", attributes.get("completion_tokens", 0))
+            if cache is not None:
+                cache.put(cache_key, content)
+
+        if checkpoint is not None:
+            checkpoint[section] = {"prompt": prompt, "content": content}
+        if on_done is not None:
+            on_done(section)
+        return content
+
+    results = await asyncio.gather(*(generate(section, prompt) for section, prompt in prompts.items()), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return dict(zip(prompts, results))
+
+# Function to generate a full proposal: Part 1 first, then the Part 2 sections in parallel
+#
+# With `previous` (an earlier result) and `sections` (keys of SECTION_DEPENDENCIES), only those
+# units are generated; every other unit keeps the content, prompt and token report it had.
+async def generate_proposal(async_client, prompt_data, part2_concurrency, cache=None, on_update=None, force=False,
+                            limiter=None, caller=None, checkpoint=None, previous=None, sections=None, on_done=None):
+    options = dict(cache=cache, on_update=on_update, force=force, limiter=limiter, caller=caller, checkpoint=checkpoint,
+                   on_done=on_done)
+    if previous is None or sections is None:
+        sections = list(SECTION_DEPENDENCIES)
+    inputs = dict(previous["section_inputs"]) if previous is not None else {}
+    built_from = dict(previous.get("part2_built_from", {})) if previous is not None else {}
+
+    with span("generation.total", client=prompt_data['Client_Name'], project=prompt_data['Project_Name'], sections=len(sections)):
+        if PART1_KEY in sections:
+            prompt_part1, report_part1 = budget_prompt_part1(prompt_data)
+            check_budget(PART1_KEY, report_part1)
+            part1 = await generate_sections(async_client, {PART1_KEY: prompt_part1}, 1, **options)
+            content_part1 = part1[PART1_KEY]
+            inputs[PART1_KEY] = section_inputs(prompt_data, PART1_KEY)
+        else:
+            prompt_part1, content_part1, report_part1 = previous["prompt_part1"], previous["part1"], previous["tokens"][PART1_KEY]
+        tokens = {PART1_KEY: report_part1}
+
+        # Build one prompt per Part 2 section around a digest of Part 1
+        part1_digest = digest_part1(content_part1)
+        prompts_part2 = {}
+        for section in SECTIONS_PART2:
+            if section in sections:
+                prompts_part2[section], tokens[section] = budget_prompt_part2(prompt_data, part1_digest, section)
+                check_budget(section, tokens[section])
+                inputs[section] = section_inputs(prompt_data, section)
+                built_from[section] = digest_hash(part1_digest)
+        contents_part2 = await generate_sections(async_client, prompts_part2, part2_concurrency, **options) if prompts_part2 else {}
+        metrics.increment("sections_reused", len(SECTION_DEPENDENCIES) - len(sections))
+
+        # Sections that were not regenerated are carried over, all in section order
+        for section in SECTIONS_PART2:
+            if section not in sections:
+                prompts_part2[section] = previous["prompts_part2"][section]
+                contents_part2[section] = previous["sections_part2"][section]
+                tokens[section] = previous["tokens"][section]
+        prompts_part2 = {section: prompts_part2[section] for section in SECTIONS_PART2}
+        contents_part2 = {section: contents_part2[section] for section in SECTIONS_PART2}
+        tokens = {key: tokens[key] for key in SECTION_DEPENDENCIES}
+
+        # Assemble the sections back in the order of the section overviews
+        content_part2 = "\n\n".join(contents_part2[section] for section in SECTION_OVERVIEWS if section in contents_part2)
+
+    return {
+        "prompt_part1": prompt_part1,
+        "prompts_part2": prompts_part2,
+        "part1": content_part1,
+        "sections_part2": contents_part2,
+        "part2": content_part2,
+        "full_proposal": content_part1 + "\n\n" + content_part2,
+        "tokens": tokens,
+        "section_inputs": {key: inputs[key] for key in SECTION_DEPENDENCIES},
+        "part1_digest": digest_hash(part1_digest),
+        "part2_built_from": {section: built_from.get(section) for section in SECTIONS_PART2},
+    }
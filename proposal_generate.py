@@ -1,151 +1,287 @@
 # Import Packages
+import asyncio
+import hashlib
+import logging
+import secrets
+import time
+from urllib.parse import urlencode
 import streamlit as st
-from openai import AzureOpenAI
-import snowflake.connector
 import pandas as pd
 import requests
-from msal import ConfidentialClientApplication
+from completion_cache import CompletionCache
+from capture_data import (cached_prompt_data, capture_index, capture_rows, fetch_capture_rows, fetch_prompt_data,
+                          list_client_projects, read_capture_csv)
+from generation_jobs import JobManager, JobQueueFull
+from resilient_llm import ResilientCaller
+from telemetry import configure_logging, metrics, span, start_metrics_dumper, start_metrics_server
+from proposal_core import (SECTIONS_PART1, SECTIONS_PART2, SECTION_OVERVIEWS, SECTION_DEPENDENCIES, PART1_KEY, budget_prompt_part1,
+                           generate_proposal, outdated_sections, process_data, stale_sections)
 
 # Streamlit Configuration and Logo Display
 logo_path = "images/Logos_White.png"
 st.set_page_config(layout="wide")
 st.image(logo_path, width=600) 
 
-# Configure OpenAI Client
-api_key = st.secrets["OPENAI_API_KEY"]
-api_version = st.secrets["OPENAI_API_VERSION"]
-azure_endpoint = st.secrets["OPENAI_API_ENDPOINT"]
-
-client = AzureOpenAI(
-    api_key=api_key,
-    api_version=api_version,
-    azure_endpoint=azure_endpoint,
-)
-
-# Configure MSAL Authentication (Unchanged)
-client_id = st.secrets["CLIENT_ID"]
-client_secret = st.secrets["CLIENT_SECRET"]
-tenant_id = st.secrets["TENANT_ID"]
-authority = f"https://login.microsoftonline.com/{tenant_id}"
+# Shared resources (OpenAI, MSAL, Snowflake) are built the first time a code path needs them,
+# so the login page renders without touching any of them
+
+logger = logging.getLogger("proposal_generate")
+
+# Function to read an on/off secret; a quoted "false" must not switch the feature on
+def secret_flag(name, default=False):
+    value = st.secrets.get(name, default)
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes", "on"):
+        return True
+    if text in ("false", "0", "no", "off", ""):
+        return False
+    logger.warning("Secret %s must be true or false, got %r; using %s", name, value, default)
+    return default
+
+# Deadline, retry and hedging settings for every GPT-4 call
+LLM_DEADLINE_SECONDS = float(st.secrets.get("LLM_DEADLINE_SECONDS", 180))
+HEDGE_REQUESTS = secret_flag("HEDGE_REQUESTS")
+
+# Settings are read in the script thread; generation jobs build the client in their worker thread
+def openai_client_settings():
+    return dict(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        api_version=st.secrets["OPENAI_API_VERSION"],
+        azure_endpoint=st.secrets["OPENAI_API_ENDPOINT"],
+        timeout=LLM_DEADLINE_SECONDS,
+        max_retries=0,  # retries are handled by ResilientCaller
+    )
+
+# Async clients are created per generation so their connections never outlive the event loop
+def make_async_client(settings):
+    from openai import AsyncAzureOpenAI
+
+    return AsyncAzureOpenAI(**settings)
+
+# One caller per process so its latency percentiles cover every session
+@st.cache_resource
+def get_llm_caller():
+    return ResilientCaller(deadline_seconds=LLM_DEADLINE_SECONDS, hedge=HEDGE_REQUESTS)
+
+# Configure MSAL Authentication
+AUTH_SCOPES = ["User.Read"]
 redirect_uri = "https://proposal-generate.streamlit.app/" #Prod
 #redirect_uri = "http://localhost:8504/"  # Dev
 
-app = ConfidentialClientApplication(client_id, authority=authority, client_credential=client_secret)
-
-def get_auth_url():
-    return app.get_authorization_request_url(["User.Read"], redirect_uri=redirect_uri)
+def get_authority():
+    return f"https://login.microsoftonline.com/{st.secrets['TENANT_ID']}"
+
+# Returning users are signed in again by Azure AD itself: the page URL only remembers which
+# account to suggest (not a credential), and a prompt=none request succeeds only while that
+# browser still holds the user's Azure AD sign-in cookie
+ACCOUNT_PARAM = "account"
+# Browser tab id kept in the page URL, so a refreshed tab can reattach to its generation job;
+# it rides through Azure AD sign-in as the OAuth state
+TAB_PARAM = "tab"
+
+# Built once per process; constructing it fetches the tenant's OpenID metadata
+@st.cache_resource
+def get_msal_app():
+    from msal import ConfidentialClientApplication
+
+    return ConfidentialClientApplication(st.secrets["CLIENT_ID"], authority=get_authority(), client_credential=st.secrets["CLIENT_SECRET"])
+
+# Same authorization request MSAL builds, without constructing the MSAL client for the login page
+def get_auth_url(prompt=None, login_hint=None, state=None):
+    params = {
+        "client_id": st.secrets["CLIENT_ID"],
+        "response_type": "code",
+        "redirect_uri": redirect_uri,
+        "scope": " ".join(AUTH_SCOPES + ["offline_access", "openid", "profile"]),
+    }
+    if prompt:
+        params["prompt"] = prompt
+    if login_hint:
+        params["login_hint"] = login_hint
+    if state:
+        params["state"] = state
+    return f"{get_authority()}/oauth2/v2.0/authorize?{urlencode(params)}"
 
 def get_token_from_code(code):
-    return app.acquire_token_by_authorization_code(code, scopes=["User.Read"], redirect_uri=redirect_uri)
+    with span("auth.token_exchange"):
+        return get_msal_app().acquire_token_by_authorization_code(code, scopes=AUTH_SCOPES, redirect_uri=redirect_uri)
+
+# Graph requests share one pooled keep-alive session per process
+GRAPH_TIMEOUT = (3.05, 10)
+PROFILE_TTL_SECONDS = 3600
+
+@st.cache_resource
+def get_graph_session():
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry))
+    return session
+
+# Profiles are cached per account; the token is not part of the cache key
+@st.cache_data(ttl=PROFILE_TTL_SECONDS, show_spinner=False)
+def fetch_user_profile(account_key, _access_token):
+    headers = {'Authorization': f"Bearer {_access_token}"}
+    with span("auth.graph_me"):
+        response = get_graph_session().get('https://graph.microsoft.com/v1.0/me', headers=headers, timeout=GRAPH_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
 
 def get_user_info(token):
-    headers = {'Authorization': f"Bearer {token['access_token']}"}
-    response = requests.get('https://graph.microsoft.com/v1.0/me', headers=headers)
-    user_info = response.json()
+    claims = token.get("id_token_claims", {})
+    account_key = claims.get("oid") or hashlib.sha256(token['access_token'].encode("utf-8")).hexdigest()
+    try:
+        user_info = fetch_user_profile(account_key, token['access_token'])
+    except (requests.RequestException, ValueError) as e:
+        # Failed lookups are not cached; main() keeps retrying until the user id is known
+        st.error(f"Failed to get user info: {e}")
+        user_info = {}
     user_email = user_info.get("mail", user_info.get("userPrincipalName", ""))
+    if user_info and not user_email:
+        st.error("Your Microsoft account has no email address")
     st.session_state['user_id'] = user_email
     return user_email
 
-# Configure Snowflake Connection (Unchanged)
-user = st.secrets["SNOWFLAKE_USER"]
-password = st.secrets["SNOWFLAKE_PASSWORD"]
-account = st.secrets["SNOWFLAKE_ACCOUNT"]
-warehouse = st.secrets["SNOWFLAKE_WAREHOUSE"]
-database = st.secrets["SNOWFLAKE_DATABASE"]
-schema = st.secrets["SNOWFLAKE_SCHEMA"]
-
-# Snowflake connection 
-conn = snowflake.connector.connect(
-    user=user,
-    password=password,
-    account=account,
-    warehouse=warehouse,
-    database=database,
-    schema=schema
-)
-
-# System Message for OpenAI (Unchanged)
-SYSTEM_MESSAGE =  """
-You are an experienced proposal writer for Decision Inc, tasked with generating professional, comprehensive, and persuasive proposal documentation for clients.
-Your goal is to create an in-depth proposal based on the provided context, tailored specifically to the client's needs.
-Ensure coherence, professionalism, and persuasive language throughout the proposal.
-Avoid unnecessary content like company letterheads, greetings, signatures, or repetitive information.
-Write in a professional and formal tone suitable for a high-stakes project proposal from a leading data consultancy to an important client.
-Your writing should be detailed, insightful, and demonstrate a deep understanding of the client's challenges and how our solutions can address them.
-"""
-
-# Function to process data into a dictionary (Unchanged)
-def process_data(rows):
-    data = {}
-    for row in rows:
-        client_name, project = row
-        if client_name in data:
-            data[client_name].append(project)
-        else:
-            data[client_name] = [project]
-    return data
-
-# Function to build prompts (Unchanged)
-def build_prompt_part1(prompt_data, sections, section_overviews):
-    # Concisely format the prompt data
-    prompt_data_text = f"""
-Client Name: {prompt_data['Client_Name']}
-Project Name: {prompt_data['Project_Name']}
-Solution: {prompt_data['Solution']}
-Key Challenges - High Importance: {prompt_data['Key_challenges_high']}
-Key Challenges - Medium Importance: {prompt_data['Key_challenges_medium']}
-Key Challenges - Low Importance: {prompt_data['Key_challenges_low']}
-Solution Aspects: {prompt_data['Solution_aspect']}
-Additional Information: {prompt_data['Additional_info']}
-"""
-
-    # Build the instructions for the first set of sections
-    sections_text = ""
-    for section in sections:
-        sections_text += f"### {section}\n{section_overviews[section]}\n\n"
-
-    # Build the full prompt for part 1
-    full_prompt = f"""
-Use the following client information to inform your writing:
-{prompt_data_text}
-
-Please generate a comprehensive, detailed, and in-depth proposal with the following sections:
-
-{sections_text}
-
-Each section should be extensive and provide substantial information, insights, and analysis. Use professional language, and ensure the proposal is coherent and flows logically from one section to the next. Include relevant examples, data, and references where appropriate to support the content.
-"""
-    return full_prompt
-
-def build_prompt_part2(prompt_data, previous_content, sections, section_overviews):
-    # Build the instructions for the remaining sections
-    sections_text = ""
-    for section in sections:
-        sections_text += f"### {section}\n{section_overviews[section]}\n\n"
-
-    # Build the full prompt for part 2
-    full_prompt = f"""
-{SYSTEM_MESSAGE}
-
-Use the following client information to inform your writing:
-Client Name: {prompt_data['Client_Name']}
-Project Name: {prompt_data['Project_Name']}
-Solution: {prompt_data['Solution']}
-Solution Aspects: {prompt_data['Solution_aspect']}
-
-Previously generated content:
-{previous_content}
-
-Please continue generating the proposal with the following sections:
-
-{sections_text}
-
-Each section should be extensive and provide substantial information, insights, and analysis. Ensure coherence with the previous sections and maintain a consistent professional tone. Use relevant examples, data, and references where appropriate to support the content.
-"""
-    return full_prompt
+# Snowflake connections are pooled once per process and shared across sessions
+@st.cache_resource
+def get_snowflake_pool():
+    from snowflake_pool import SnowflakePool
+
+    return SnowflakePool(
+        dict(
+            user=st.secrets["SNOWFLAKE_USER"],
+            password=st.secrets["SNOWFLAKE_PASSWORD"],
+            account=st.secrets["SNOWFLAKE_ACCOUNT"],
+            warehouse=st.secrets["SNOWFLAKE_WAREHOUSE"],
+            database=st.secrets["SNOWFLAKE_DATABASE"],
+            schema=st.secrets["SNOWFLAKE_SCHEMA"]
+        ),
+        max_size=int(st.secrets.get("SNOWFLAKE_POOL_SIZE", 4)),
+    )
+
+# Part 2 sections are generated in parallel from a compact shared context
+PART2_CONCURRENCY = int(st.secrets.get("PART2_CONCURRENCY", 4))
+
+# Completions are cached on disk, keyed by a hash of the model, temperature and messages
+COMPLETION_CACHE_PATH = st.secrets.get("COMPLETION_CACHE_PATH", ".cache/completions.sqlite3")
+
+@st.cache_resource
+def get_completion_cache():
+    return CompletionCache(COMPLETION_CACHE_PATH)
+
+# Stage timings: JSON span logs, optional Prometheus text file and /metrics endpoint, admin-only panel
+METRICS_FILE = st.secrets.get("METRICS_FILE")
+METRICS_PORT = st.secrets.get("METRICS_PORT")
+ADMIN_USERS = [email.lower() for email in st.secrets.get("ADMIN_USERS", [])]
+
+@st.cache_resource
+def init_telemetry():
+    configure_logging()
+    if METRICS_FILE:
+        start_metrics_dumper(METRICS_FILE)
+    if METRICS_PORT:
+        return start_metrics_server(int(METRICS_PORT))
+
+# Function to show p50/p95 per stage to admins
+def render_performance_panel():
+    summary = metrics.summary()
+    with st.sidebar.expander("Performance (admin)"):
+        if not summary:
+            st.caption("No timings recorded yet.")
+            return
+        st.dataframe(pd.DataFrame([
+            {"Stage": stage, "Runs": stats["count"], "p50 (s)": round(stats["p50"], 3),
+             "p95 (s)": round(stats["p95"], 3), "Max (s)": round(stats["max"], 3)}
+            for stage, stats in summary.items()
+        ]), hide_index=True)
+        counters = dict(metrics.counters)
+        if counters:
+            st.caption(" | ".join(f"{name}: {value:g}" for name, value in sorted(counters.items())))
+        st.download_button("Download metrics", metrics.prometheus_text(), file_name="metrics.prom")
+
+# Client/project picker options, cached per user so reruns do not hit the warehouse
+PICKER_TTL_SECONDS = 600
+
+@st.cache_data(ttl=PICKER_TTL_SECONDS, show_spinner=False)
+def fetch_client_projects(user_id, filter_by_user):
+    with get_snowflake_pool().connection() as conn, span("snowflake.picker_query") as attributes:
+        rows = list_client_projects(conn, user_id if filter_by_user else None)
+        attributes["rows"] = len(rows)
+    return process_data(rows)
+
+# Function to run a proposal generation on a fresh async client
+async def run_generation(client_settings, prompt_data, part2_concurrency, on_update=None, force=False, checkpoint=None, previous=None,
+                         sections=None, cache=None, caller=None, on_done=None):
+    async with make_async_client(client_settings) as async_client:
+        return await generate_proposal(async_client, prompt_data, part2_concurrency, cache, on_update, force,
+                                       caller=caller, checkpoint=checkpoint, previous=previous, sections=sections, on_done=on_done)
+
+# Generations run on a process-wide pool so reruns and other users' sessions never wait on them
+GENERATION_WORKERS = int(st.secrets.get("GENERATION_WORKERS", 4))
+GENERATION_QUEUE_SIZE = int(st.secrets.get("GENERATION_QUEUE_SIZE", 16))
+JOB_POLL_SECONDS = 1.0
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager(GENERATION_WORKERS, GENERATION_QUEUE_SIZE)
+
+# Jobs belong to the user and their browser tab; a refresh starts a new session, which takes the
+# tab id back from the URL to find its job again
+def job_owner():
+    if "job_session" not in st.session_state:
+        st.session_state["job_session"] = st.query_params.get(TAB_PARAM) or secrets.token_urlsafe(16)
+    st.query_params[TAB_PARAM] = st.session_state["job_session"]
+    return f"{st.session_state.get('user_id', '')}:{st.session_state['job_session']}"
+
+# Function to queue a generation; Streamlit resources are resolved here, in the script thread
+def start_generation_job(prompt_data, part2_concurrency, stream_output, force, previous, sections):
+    client_settings, cache, caller = openai_client_settings(), get_completion_cache(), get_llm_caller()
+
+    # Section status is always reported; streamed text only when the user asked for it
+    def run(job):
+        return asyncio.run(run_generation(client_settings, prompt_data, part2_concurrency, job.on_update if stream_output else None, force,
+                                          job.checkpoint, previous, sections, cache=cache, caller=caller, on_done=job.mark_done))
+
+    return get_job_manager().submit(job_owner(), run, sections or list(SECTION_DEPENDENCIES),
+                                    checkpoint=st.session_state.get("generation_checkpoint"))
+
+# Button and notice labels per generated unit; Part 1 writes two sections in one completion
+SECTION_LABELS = {PART1_KEY: " and ".join(SECTIONS_PART1), **{section: section for section in SECTIONS_PART2}}
+
+# Function to follow this session's job; only this fragment reruns while the job is in flight
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress(owner, previous):
+    job = get_job_manager().get(owner)
+    if job is None or job.finished:
+        # Full rerun so the page takes over the result
+        st.rerun()
+
+    snapshot = job.snapshot()
+    if snapshot["status"] == "queued":
+        stats = get_job_manager().stats()
+        st.info(f"Waiting for a free generator ({stats['running']} of {stats['workers']} busy). You can keep using the page.")
+    else:
+        done = sum(status == "done" for status in snapshot["section_status"].values())
+        st.progress(done / len(snapshot["section_status"]),
+                    text=f"Generating {done}/{len(snapshot['section_status'])} parts in the background. You can keep using the page.")
+
+    st.markdown("## Full Proposal")
+    for key in SECTION_DEPENDENCIES:
+        status = snapshot["section_status"].get(key)
+        if status is not None:
+            st.caption(f"{SECTION_LABELS[key]}: {status}")
+        if key in snapshot["text"]:
+            st.markdown(snapshot["text"][key])
+        elif previous is not None:
+            st.markdown(previous["part1"] if key == PART1_KEY else previous["sections_part2"][key])
 
 # Main Application Function
 def main():
+    init_telemetry()
     st.markdown("# Proposal Documentation Generator")
     
     query_params = st.query_params
@@ -155,19 +291,52 @@ def main():
             code = query_params["code"]
             token = get_token_from_code(code)
             if "access_token" in token:
+                token["expires_at"] = time.time() + token.get("expires_in", 0)
                 st.session_state["token"] = token
-                user_email = get_user_info(token)
-                st.session_state['user_id'] = user_email
+
+                # Only the account name and tab id stay in the URL, so a refresh can ask Azure AD to sign
+                # it in silently and pick up this tab's job
+                account = token.get("id_token_claims", {}).get("preferred_username")
+                tab = query_params.get("state")
+                query_params.clear()
+                if account:
+                    query_params[ACCOUNT_PARAM] = account
+                if tab:
+                    query_params[TAB_PARAM] = tab
                 st.rerun() 
             else:
                 st.error("Failed to get token")
         else:
-            auth_url = get_auth_url()
-            st.link_button("Login with Azure AD",auth_url)
+            account = query_params.get(ACCOUNT_PARAM)
+            tab = query_params.get(TAB_PARAM)
+            if "error" in query_params:
+                # prompt=none could not sign in silently (no Azure AD session in this browser)
+                tab = query_params.get("state")
+                for param in ("error", "error_description", "error_uri", "error_subcode", "state", ACCOUNT_PARAM):
+                    query_params.pop(param, None)
+                if tab:
+                    query_params[TAB_PARAM] = tab
+                account = None
+                st.info("Your Microsoft sign-in has expired. Please log in again.")
+            if account:
+                st.link_button(f"Continue as {account}", get_auth_url(prompt="none", login_hint=account, state=tab))
+                st.link_button("Use another account", get_auth_url(prompt="select_account", state=tab))
+            else:
+                auth_url = get_auth_url(state=tab)
+                st.link_button("Login with Azure AD",auth_url)
 
     else:
         token = st.session_state["token"]
 
+        # The user id is looked up after the sign-in rerun, so a Graph failure stays on screen
+        if not st.session_state.get('user_id'):
+            if token.get("expires_at", 0) < time.time():
+                del st.session_state["token"]
+                st.rerun()
+            if not get_user_info(token):
+                st.button("Try again")
+                st.stop()
+
         # Initialize df in session state if not already present
         if 'df' not in st.session_state:
             columns = ["CLIENT", "PROJECT_NAME", "SOLUTION", "CATEGORY", "SUB_CATEGORY", "IMPORTANCE", "USER_INPUT", "KEY", "USER_ID", "SESSION ID", "DATE_LOADED"]
@@ -179,57 +348,47 @@ def main():
             st.subheader("Upload CSV")
             uploaded_file = st.file_uploader("Choose a CSV file", type=['csv'], key='file_uploader')
             
-            if uploaded_file is not None:
-                try:
-                    data = pd.read_csv(uploaded_file)
-                    required_columns_count = 11  
-                    if data.shape[1] != required_columns_count:
-                        st.error(f"The uploaded CSV does not contain the correct number of columns. Expected {required_columns_count} columns.")
-                    elif 'SOLUTION' not in data.columns:
-                        st.error("The uploaded CSV file must include a 'SOLUTION' field.")
-                    else:
-                        data['SOLUTION'] = data['SOLUTION'].replace(to_replace='ILA', value='Information Landscape Assessment')
-                        st.session_state.df = data  
+            if uploaded_file is None:
+                st.session_state.pop("csv_upload", None)
+            else:
+                # Parsed once per uploaded file; reruns reuse the typed frame and its client/project index
+                upload = st.session_state.get("csv_upload")
+                if upload is None or upload["file_id"] != uploaded_file.file_id:
+                    try:
+                        with span("csv.ingest", size_bytes=uploaded_file.size):
+                            data = read_capture_csv(uploaded_file)
+                        upload = {"file_id": uploaded_file.file_id, "data": data, "index": capture_index(data), "selected": None}
+                        st.session_state["csv_upload"] = upload
+                        if not upload["index"]:
+                            st.error("The uploaded CSV does not contain any client/project rows.")
+                    except Exception as e:
+                        upload = None
+                        st.session_state.pop("csv_upload", None)
+                        st.error(f"Failed to read the uploaded file. The error was: {e}")
+
+                if upload is not None and upload["index"]:
+                    csv_clients = list(upload["index"].keys())
+                    csv_client = st.selectbox("Client in file", csv_clients, key="csv_client")
+                    csv_project = st.selectbox("Project in file", upload["index"][csv_client], key="csv_project")
+
+                    # Only a new file or a new selection replaces the data, so other sources are not overwritten on rerun
+                    if upload["selected"] != (csv_client, csv_project):
+                        upload["selected"] = (csv_client, csv_project)
+                        st.session_state.df = capture_rows(upload["data"], csv_client, csv_project)
+                        st.session_state.pop("prompt_data", None)
                         st.session_state["data_connected"] = True
                         st.success("File uploaded successfully", icon="✅")
-                except Exception as e:
-                    st.error(f"Failed to read the uploaded file. The error was: {e}")
-                
+
             st.subheader("Connect via Snowflake")
             filter_by_user = st.checkbox("Filter for my user only", value=True)
 
-            # Fetch clients and projects (Unchanged)
+            # Drops only this user's cached list for the current filter; other users keep theirs
+            if st.button("Refresh client list"):
+                fetch_client_projects.clear(st.session_state['user_id'], filter_by_user)
+
+            # Fetch clients and projects (cached per user)
             try:
-                with conn.cursor() as cur:
-                    if filter_by_user:
-                        sql_query = """
-                            WITH details AS (
-                                SELECT DISTINCT CLIENT, PROJECT_NAME, SESSION_ID 
-                                FROM CAPTURED_PROPOSAL_DATA
-                                WHERE USER_ID = %(user_id)s
-                            )
-                            SELECT CLIENT, PROJECT_NAME 
-                            FROM details 
-                            WHERE CLIENT != '' 
-                            ORDER BY CLIENT;
-                        """
-                        cur.execute(sql_query, {'user_id': st.session_state['user_id']})  
-                    else:
-                        sql_query = """
-                            WITH details AS (
-                                SELECT DISTINCT CLIENT, PROJECT_NAME, SESSION_ID 
-                                FROM CAPTURED_PROPOSAL_DATA
-                            )
-                            SELECT CLIENT, PROJECT_NAME 
-                            FROM details 
-                            WHERE CLIENT != '' 
-                            ORDER BY CLIENT;
-                        """
-                        cur.execute(sql_query)
-
-                    rows = cur.fetchall()
-
-                data = process_data(rows)
+                data = fetch_client_projects(st.session_state['user_id'], filter_by_user)
                 client_options = list(data.keys())
 
                 client_name = st.selectbox("Select a Client", client_options, index=0 if client_options else None)
@@ -237,24 +396,37 @@ def main():
                     project_options = list(set(data[client_name]))
                     project_name = st.selectbox("Select a Project", project_options, index=0 if project_options else None)
 
+                server_side_prompt = st.checkbox("Build prompt fields in Snowflake", value=True,
+                                                 help="Returns only the finished prompt fields instead of every capture row.")
                 connect_button = st.button(label="Connect to Database")
                 
                 if connect_button and client_name and project_name:
                     try:
-                        with conn.cursor() as cur:
-                            sql = """
-                            SELECT *
-                            FROM CAPTURED_PROPOSAL_DATA
-                            WHERE client = %(client_name)s AND project_name = %(project_name)s;
-                            """
-                            cur.execute(sql, {'client_name': client_name, 'project_name': project_name})
-                            st.session_state.df = cur.fetch_pandas_all()
+                        if server_side_prompt:
+                            with get_snowflake_pool().connection() as conn, span("snowflake.prompt_query"):
+                                prompt_data = fetch_prompt_data(conn, client_name, project_name)
                             st.session_state["data_connected"] = True
-                            
-                            if st.session_state.df.empty:
+
+                            if prompt_data is None:
+                                st.session_state.df = pd.DataFrame()
+                                st.session_state.pop("prompt_data", None)
                                 st.error("No data returned from Snowflake.")
                             else:
+                                st.session_state.prompt_data = prompt_data
+                                st.session_state.df = pd.DataFrame([prompt_data])
                                 st.success("Successfully connected to Snowflake", icon="✅")
+                        else:
+                            with get_snowflake_pool().connection() as conn, span("snowflake.capture_query"):
+                                data = fetch_capture_rows(conn, client_name, project_name)
+                                data['SOLUTION'] = data['SOLUTION'].replace(to_replace='ILA', value='Information Landscape Assessment')
+                                st.session_state.df = data
+                                st.session_state.pop("prompt_data", None)
+                                st.session_state["data_connected"] = True
+                                
+                                if st.session_state.df.empty:
+                                    st.error("No data returned from Snowflake.")
+                                else:
+                                    st.success("Successfully connected to Snowflake", icon="✅")
 
                     except Exception as e:
                         st.error(f"Failed to connect to Snowflake: {e}")
@@ -275,80 +447,31 @@ def main():
         if st.session_state.df.empty and not st.session_state.get("data_connected", False):
             st.write("Please upload a file or connect to Snowflake to continue")
         else:
-            st.session_state.df['SOLUTION'] = st.session_state.df['SOLUTION'].replace(to_replace='ILA', value='Information Landscape Assessment')
-
-            # Extract key variables (Unchanged)
-            Solution = st.session_state.df['SOLUTION'].drop_duplicates().iloc[0]
-            Project = st.session_state.df['PROJECT_NAME'].drop_duplicates().iloc[0]
-            client_name = st.session_state.df['CLIENT'].drop_duplicates().iloc[0]
-
-            Sol = st.session_state.df[(st.session_state.df['CATEGORY'] == 'Solutions Aspect')]
-            Solution_aspect = '\n'.join(Sol.apply(lambda row: f"{row['SUB_CATEGORY']}: {row['USER_INPUT']}", axis=1))
-
-            KCH = st.session_state.df[(st.session_state.df['CATEGORY']=='Key Challenges') & (st.session_state.df['IMPORTANCE'] == 'High')]
-            Key_challenges_high = '\n'.join(KCH.apply(lambda row: f"{row['SUB_CATEGORY']}: {row['USER_INPUT']}", axis=1))
-
-            KCM = st.session_state.df[(st.session_state.df['CATEGORY']=='Key Challenges') & (st.session_state.df['IMPORTANCE'] == 'Moderate')]
-            Key_challenges_medium = '\n'.join(KCM.apply(lambda row: f"{row['SUB_CATEGORY']}: {row['USER_INPUT']}", axis=1))
-
-            KCL = st.session_state.df[(st.session_state.df['CATEGORY']=='Key Challenges') & (st.session_state.df['IMPORTANCE'] == 'Low')]
-            Key_challenges_low = '\n'.join(KCL.apply(lambda row: f"{row['SUB_CATEGORY']}: {row['USER_INPUT']}", axis=1))
-
-            Add = st.session_state.df[(st.session_state.df['CATEGORY'] == 'Additional Info')]
-            Additional_info = '\n'.join(Add['USER_INPUT'])
-
-            # Prepare prompt data (Unchanged)
-            prompt_data = {
-                'Client_Name': client_name,
-                'Project_Name': Project,
-                'Solution': Solution,
-                'Key_challenges_high': Key_challenges_high,
-                'Key_challenges_medium': Key_challenges_medium,
-                'Key_challenges_low': Key_challenges_low,
-                'Solution_aspect': Solution_aspect,
-                'Additional_info': Additional_info
-            }
-
-            # Define sections and their overviews (Unchanged)
-            sections_part1 = ['Executive Summary', 'Client Background and Problem Statement']
-            sections_part2 = ['Solution Overview', 'Scope of Work', 'Proposed Enabling Technology', 'Statement of Work']
-
-            section_overviews = {
-                'Executive Summary': (
-                    "Provide a detailed introduction to the client's situation, including their industry, market position, and key challenges. "
-                    "Explain how our solution addresses their needs and the anticipated benefits. "
-                    "Highlight the unique value proposition and why we are the best choice for this project."
-                ),
-                'Client Background and Problem Statement': (
-                    "Thoroughly describe the client's background, including their history, mission, and strategic objectives. "
-                    "Detail the specific challenges they are facing, supported by data or examples where possible. "
-                    "Explain how these challenges impact their business operations and strategic goals."
-                ),
-                'Solution Overview': (
-                    "Present an in-depth outline of the proposed solution. "
-                    "Explain the methodology, processes, and technologies involved. "
-                    "Illustrate how the solution addresses each of the client's challenges, and include case studies or success stories from similar projects."
-                ),
-                'Scope of Work': (
-                    "Detail all tasks, deliverables, and methodologies required to implement the solution. "
-                    "Break down the project phases, timelines, and resource allocations. "
-                    "Include responsibilities, milestones, and key performance indicators (KPIs) to measure success."
-                ),
-                'Proposed Enabling Technology': (
-                    "Discuss in detail the technology stack that will support the proposed solution. "
-                    "Explain why these technologies are the best fit for the client’s needs. "
-                    "Include technical specifications, integration strategies, and how the technology aligns with the client's existing systems."
-                ),
-                'Statement of Work': (
-                    "Summarize the formal terms of the proposal, including all deliverables, detailed timelines, pricing structures, payment schedules, and expected outcomes. "
-                    "Outline the terms and conditions, acceptance criteria, and any assumptions or dependencies. "
-                    "Ensure clarity to avoid any ambiguities regarding project execution."
-                )
-            }
+            if st.session_state.get("prompt_data") is not None:
+                # Prompt fields were already assembled in Snowflake
+                prompt_data = st.session_state.prompt_data
+            else:
+                # Built in one grouped pass and only recomputed when the capture rows change
+                prompt_data = cached_prompt_data(st.session_state.df)
+
+            if prompt_data is None:
+                st.write("The capture form has no rows to build a proposal from.")
+                return
+
+            sections_part1 = SECTIONS_PART1
+            sections_part2 = SECTIONS_PART2
+            section_overviews = SECTION_OVERVIEWS
 
             # Build prompts for part 1 and part 2
-            full_prompt_part1 = build_prompt_part1(prompt_data, sections_part1, section_overviews)
+            full_prompt_part1, tokens_part1 = budget_prompt_part1(prompt_data)
             st.session_state.full_prompt_part1 = full_prompt_part1
+            st.caption(f"Part 1 prompt: {tokens_part1['total']} tokens")
+            if tokens_part1['over_budget']:
+                st.error(f"The capture form needs {tokens_part1['total']} prompt tokens but the budget is {tokens_part1['budget']}, "
+                         "even with every low priority field trimmed. Shorten the high priority challenges or the solution aspects to generate a proposal.")
+            elif tokens_part1['trimmed']:
+                st.warning("The capture form is larger than the prompt budget; low priority fields were trimmed: "
+                           + ", ".join(item['field'] for item in tokens_part1['trimmed']))
 
             # Optional: Add a button to display the full prompt for part 1
             if st.button("Show Full Prompt Part 1", key='show_prompt_part1'):
@@ -358,57 +481,93 @@ def main():
                 else:
                     st.error("No prompt available. Please connect to data first.")
 
-            # Single "Generate Proposal" button
-            if st.button("Generate Proposal", key='generate_full_proposal'):
-                with st.spinner("Generating the proposal..."):
-                    if 'full_prompt_part1' in st.session_state:
-                        try:
-                            # Generate Part 1
-                            messages_part1 = [
-                                {"role": "system", "content": SYSTEM_MESSAGE},
-                                {"role": "user", "content": st.session_state.full_prompt_part1}
-                            ]
-
-                            response_part1 = client.chat.completions.create(
-                                model="gpt-4",
-                                messages=messages_part1,
-                                temperature=0.7,
-                                #max_tokens=7500
-                            )
-                            content_part1 = response_part1.choices[0].message.content.strip()
-                            st.session_state.proposal_content_part1 = content_part1
-
-                            # Build prompt for Part 2
-                            previous_content = st.session_state.proposal_content_part1
-                            full_prompt_part2 = build_prompt_part2(prompt_data, previous_content, sections_part2, section_overviews)
-                            st.session_state.full_prompt_part2 = full_prompt_part2
-
-                            # Generate Part 2
-                            messages_part2 = [
-                                {"role": "system", "content": SYSTEM_MESSAGE},
-                                {"role": "user", "content": st.session_state.full_prompt_part2}
-                            ]
-
-                            response_part2 = client.chat.completions.create(
-                                model="gpt-4",
-                                messages=messages_part2,
-                                temperature=0.7,
-                                #max_tokens=7500
-                            )
-                            content_part2 = response_part2.choices[0].message.content.strip()
-                            st.session_state.proposal_content_part2 = content_part2
-
-                            # Combine both parts for the full proposal
-                            full_proposal = st.session_state.proposal_content_part1 + "\n\n" + st.session_state.proposal_content_part2
-                            st.session_state.full_proposal = full_proposal
-
-                            # Display the full proposal
-                            st.markdown("## Full Proposal")
-                            st.write(full_proposal)
-                        except Exception as e:
-                            st.error(f"Failed to generate the proposal: {e}")
-                    else:
-                        st.error("No prompt available. Please connect to data first.")
+            stream_output = st.checkbox("Stream the proposal as it is generated", value=True, key='stream_output')
+            force_regenerate = st.checkbox("Force regenerate (ignore cached completions)", value=False, key='force_regenerate')
+            part2_concurrency = st.number_input("Part 2 sections generated in parallel", min_value=1, max_value=len(sections_part2), value=min(PART2_CONCURRENCY, len(sections_part2)), key='part2_concurrency')
+
+            # A finished background job is taken over here: its result becomes the proposal on this page
+            owner = job_owner()
+            job = get_job_manager().get(owner)
+            if job is not None and job.finished:
+                finished = job.snapshot()
+                get_job_manager().discard(owner, finished["id"])
+                job = None
+                if finished["status"] == "done":
+                    result = finished["result"]
+                    st.session_state.generation_checkpoint = {}
+                    st.session_state.proposal_result = result
+                    st.session_state.proposal_content_part1 = result["part1"]
+                    st.session_state.full_prompt_part2 = "\n\n---\n\n".join(result["prompts_part2"].values())
+                    st.session_state.proposal_content_part2 = result["part2"]
+                    st.session_state.full_proposal = result["full_proposal"]
+                    st.session_state.token_report = result["tokens"]
+                else:
+                    # Sections finished by a failed attempt are kept here and reused on the next click
+                    st.session_state.generation_checkpoint = finished["checkpoint"]
+                    st.error(f"Failed to generate the proposal: {finished['error']}")
+                    if finished["checkpoint"]:
+                        st.info(f"{len(finished['checkpoint'])} finished part(s) were saved. Click Generate Proposal again to resume from them.")
+
+            # The last generated proposal; only the sections whose inputs changed since are regenerated
+            previous = st.session_state.get("proposal_result")
+            if previous is not None:
+                generated_for = previous["section_inputs"][PART1_KEY]
+                if (generated_for['Client_Name'], generated_for['Project_Name']) != (prompt_data['Client_Name'], prompt_data['Project_Name']):
+                    # A proposal for another client/project is not a starting point
+                    previous = None
+            stale = stale_sections(previous, prompt_data)
+            if previous is not None and stale and job is None:
+                st.info("The capture data changed for: " + ", ".join(SECTION_LABELS[key] for key in stale)
+                        + ". Generate Proposal updates only these.")
+            outdated = outdated_sections(previous) if previous is not None else []
+            if outdated and job is None:
+                st.info("Built from an earlier version of Part 1: " + ", ".join(SECTION_LABELS[key] for key in outdated)
+                        + ". Use their Regenerate buttons to bring them in line with the current Part 1.")
+
+            # Single "Generate Proposal" button, unavailable while this session's job is queued or running
+            generate_clicked = st.button("Generate Proposal", key='generate_full_proposal', disabled=job is not None or tokens_part1['over_budget'])
+
+            # The last proposal with a regenerate button per generated unit
+            regenerate = []
+            if previous is not None and job is None:
+                st.markdown("## Full Proposal")
+                for key in SECTION_DEPENDENCIES:
+                    st.markdown(previous["part1"] if key == PART1_KEY else previous["sections_part2"][key])
+                    if st.button(f"Regenerate {SECTION_LABELS[key]}", key=f"regenerate_{key}", disabled=tokens_part1['over_budget']):
+                        regenerate.append(key)
+
+            sections = None
+            force = force_regenerate
+            if regenerate:
+                # An explicit regenerate must not be answered from the completion cache
+                sections, force = regenerate, True
+            elif generate_clicked and previous is not None and not force_regenerate:
+                sections = stale
+                if not sections:
+                    st.info("Nothing changed since the last generation. Use a Regenerate button or Force regenerate to rewrite sections.")
+
+            if regenerate or (generate_clicked and sections != []):
+                if 'full_prompt_part1' in st.session_state:
+                    try:
+                        start_generation_job(prompt_data, part2_concurrency, stream_output, force, previous, sections)
+                        # Rerun so the page switches to following the job
+                        st.rerun()
+                    except JobQueueFull as e:
+                        st.warning(f"The generator is busy ({e}). Please try again in a minute.")
+                else:
+                    st.error("No prompt available. Please connect to data first.")
+
+            if job is not None:
+                render_job_progress(owner, previous)
+
+            # Prompt token counts per part of the last generation
+            if st.session_state.get("token_report"):
+                with st.expander("Prompt tokens per part"):
+                    st.table(pd.DataFrame([
+                        {"Part": part, "System": report["system"], "User": report["user"], "Total": report["total"],
+                         "Trimmed": ", ".join(item["field"] for item in report["trimmed"])}
+                        for part, report in st.session_state.token_report.items()
+                    ]))
 
             # Optionally, provide a button to display the full prompt for part 2
             if 'full_proposal' in st.session_state and st.session_state.full_proposal:
@@ -419,5 +578,14 @@ def main():
                     else:
                         st.error("No prompt available. Please generate the proposal first.")
 
+        # Completion cache counters, rendered last so they include this run's lookups
+        cache_stats = get_completion_cache().stats()
+        with st.sidebar:
+            st.subheader("Completion Cache")
+            st.caption(f"Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']}")
+
+        if st.session_state.get('user_id', '').lower() in ADMIN_USERS:
+            render_performance_panel()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,122 @@
+# Deadlines, retries with jittered backoff and hedged requests around LLM calls
+import asyncio
+import random
+import time
+from collections import deque
+
+
+# Errors worth another attempt: throttling, timeouts, dropped connections and 5xx responses.
+# openai is imported on first use so loading this module stays cheap.
+def retryable_errors():
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+        asyncio.TimeoutError,
+    )
+
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    # None until enough calls have been seen to trust the percentile
+    def percentile(self, q):
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# Function to read the server's requested wait from a throttled response, in seconds
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class ResilientCaller:
+    def __init__(self, deadline_seconds=180, max_attempts=4, base_delay=1.0, max_delay=30.0, hedge=False, hedge_percentile=0.95):
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+
+    # Full jitter: a random wait up to the exponential backoff, unless the server asked for longer
+    def backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after_seconds(error)
+        if requested is not None:
+            delay = max(delay, requested + random.uniform(0, self.base_delay))
+        return delay
+
+    async def _timed(self, request):
+        start = time.perf_counter()
+        result = await asyncio.wait_for(request(), self.deadline_seconds)
+        self.latency.record(time.perf_counter() - start)
+        return result
+
+    # Start a duplicate request once the first one is slower than the tracked percentile
+    async def _hedged(self, request):
+        threshold = self.latency.percentile(self.hedge_percentile)
+        primary = asyncio.ensure_future(self._timed(request))
+        if threshold is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        pending = {primary, asyncio.ensure_future(self._timed(request))}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Both requests failed: surface the primary's error
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # request is a zero-argument coroutine function; it is called again for every attempt
+    async def call(self, request, hedge=None):
+        hedge = self.hedge if hedge is None else hedge
+        retryable = retryable_errors()
+        for attempt in range(self.max_attempts):
+            try:
+                if hedge:
+                    return await self._hedged(request)
+                return await self._timed(request)
+            except retryable as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt, e))
+
+
+# Shared by every generation in the process so latency percentiles reflect recent traffic
+default_caller = ResilientCaller()
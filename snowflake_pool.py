@@ -0,0 +1,78 @@
+# Small pool of Snowflake connections shared across Streamlit sessions
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import snowflake.connector
+from snowflake.connector.errors import DatabaseError
+
+from telemetry import span
+
+
+class SnowflakePool:
+    def __init__(self, connect_kwargs, max_size=4, health_check_interval=300):
+        self.connect_kwargs = connect_kwargs
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _connect(self):
+        with span("snowflake.connect"):
+            conn = snowflake.connector.connect(client_session_keep_alive=True, **self.connect_kwargs)
+        return conn, time.monotonic()
+
+    # Connections idle for longer than the check interval are pinged before reuse
+    def _is_healthy(self, conn, last_used):
+        if conn.is_closed():
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except DatabaseError:
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()[0]
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except DatabaseError:
+            # Expired sessions and broken sockets surface here; reconnect on next checkout
+            if conn is not None:
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put((conn, time.monotonic()))
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
@@ -0,0 +1,156 @@
+# Timing spans, structured JSON logs and Prometheus-style metrics for each pipeline stage
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("proposal_generate.telemetry")
+
+# Recent spans kept per stage for the percentile summaries
+SPAN_WINDOW = 500
+# How often start_metrics_dumper rewrites the metrics file
+DUMP_INTERVAL_SECONDS = 15
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = getattr(record, "payload", None) or {"message": record.getMessage()}
+        return json.dumps({"ts": round(record.created, 3), "level": record.levelname, **payload}, default=str)
+
+
+class MetricsRegistry:
+    def __init__(self, window=SPAN_WINDOW):
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.totals = defaultdict(lambda: [0, 0.0])  # stage -> [count, seconds]
+        self.counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.durations[stage].append(seconds)
+            self.totals[stage][0] += 1
+            self.totals[stage][1] += seconds
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    # p50/p95/max per stage over the recent window
+    def summary(self):
+        with self._lock:
+            snapshot = {stage: sorted(samples) for stage, samples in self.durations.items() if samples}
+        summary = {}
+        for stage, ordered in sorted(snapshot.items()):
+            summary[stage] = {
+                "count": len(ordered),
+                "p50": ordered[int(0.50 * (len(ordered) - 1))],
+                "p95": ordered[int(0.95 * (len(ordered) - 1))],
+                "max": ordered[-1],
+            }
+        return summary
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP proposal_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE proposal_stage_duration_seconds summary",
+        ]
+        summary = self.summary()
+        with self._lock:
+            totals = {stage: list(total) for stage, total in self.totals.items()}
+            counters = dict(self.counters)
+        for stage, stats in summary.items():
+            for quantile in ("p50", "p95"):
+                lines.append(f'proposal_stage_duration_seconds{{stage="{stage}",quantile="0.{quantile[1:]}"}} {stats[quantile]:.6f}')
+            lines.append(f'proposal_stage_duration_seconds_count{{stage="{stage}"}} {totals[stage][0]}')
+            lines.append(f'proposal_stage_duration_seconds_sum{{stage="{stage}"}} {totals[stage][1]:.6f}')
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE proposal_{name}_total counter")
+            lines.append(f"proposal_{name}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+    # Written to a uniquely named temporary file first so scrapers never read a half-written dump
+    # and concurrent writers never rename each other's file
+    def dump(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory or ".", prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+# Shared by every session and thread in the process
+metrics = MetricsRegistry()
+
+# Function to time a stage; attributes added to the yielded dict are logged with the span
+@contextmanager
+def span(stage, **attributes):
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe(stage, seconds)
+        logger.info(stage, extra={"payload": {
+            "event": "span", "stage": stage, "duration_ms": round(seconds * 1000, 2), "status": status, **attributes,
+        }})
+
+# Function to send the JSON span logs to stderr unless logging was already configured
+def configure_logging(level=logging.INFO):
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Function to serve /metrics from a daemon thread
+def start_metrics_server(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+# Function to rewrite the metrics file from a daemon thread, so page reruns never do file I/O
+def start_metrics_dumper(path, interval=DUMP_INTERVAL_SECONDS):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.dump(path)
+            except OSError:
+                logger.exception("metrics dump to %s failed", path)
+
+    thread = threading.Thread(target=run, name="metrics-dumper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,121 @@
+# Token counting and context-window budgeting for the proposal prompts
+try:
+    import tiktoken
+except ImportError:  # fall back to a character estimate when the tokenizer is not installed
+    tiktoken = None
+
+# Fields trimmed, in this order, when a prompt is over budget
+TRIM_ORDER = ['previous_content', 'Key_challenges_low', 'Key_challenges_medium', 'Additional_info']
+
+# Chat format overhead per message and per reply, as documented for the gpt-4 family
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encodings = {}
+
+
+# Raised when a prompt is over budget even with every field in TRIM_ORDER emptied
+class PromptTooLarge(Exception):
+    pass
+
+
+# The encoding is None when tiktoken is missing or its BPE file cannot be fetched (offline hosts)
+def _encoding(model):
+    if model not in _encodings:
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                encoding = None
+        _encodings[model] = encoding
+    return _encodings[model]
+
+# Function to count the tokens in a piece of text
+def count_tokens(text, model="gpt-4"):
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+# Function to count the prompt tokens of a list of chat messages
+def count_message_tokens(messages, model="gpt-4"):
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message["content"], model) for message in messages) + TOKENS_PER_REPLY
+
+# Function to trim prompt inputs until the rendered messages fit in max_tokens
+#
+# render(prompt_data, previous_content) must return the chat messages. Fields are cut in
+# TRIM_ORDER: prompt_data fields lose whole lines from the end and previous_content loses
+# words from the end, keeping as much of each field as fits before moving to the next one.
+# When the untrimmable fields alone exceed max_tokens nothing is trimmed, since no amount of
+# trimming would help; token_report then flags the prompt as over budget.
+def fit_to_budget(prompt_data, previous_content, render, max_tokens, model="gpt-4"):
+    prompt_data = dict(prompt_data)
+    values = {'previous_content': previous_content or ''}
+    values.update(prompt_data)
+    trimmed = []
+
+    def size():
+        fields = {key: value for key, value in values.items() if key != 'previous_content'}
+        return count_message_tokens(render(fields, values['previous_content']), model)
+
+    total = size()
+    if total > max_tokens:
+        untrimmed = {field: values[field] for field in TRIM_ORDER if field in values}
+        values.update({field: '' for field in untrimmed})
+        floor = size()
+        values.update(untrimmed)
+        if floor > max_tokens:
+            return prompt_data, values['previous_content'], trimmed
+
+    for field in TRIM_ORDER:
+        if total <= max_tokens:
+            break
+        if not values.get(field):
+            continue
+
+        separator = ' ' if field == 'previous_content' else '\n'
+        units = values[field].split(separator)
+
+        # Largest prefix of the field that still fits
+        low, high = 0, len(units)
+        while low < high:
+            middle = (low + high + 1) // 2
+            values[field] = separator.join(units[:middle])
+            if size() <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        values[field] = separator.join(units[:low])
+        if field == 'previous_content' and 0 < low < len(units):
+            values[field] += ' ...'
+
+        new_total = size()
+        if new_total < total:
+            trimmed.append({'field': field, 'kept': low, 'of': len(units)})
+        total = new_total
+
+    fields = {key: value for key, value in values.items() if key != 'previous_content'}
+    return fields, values['previous_content'], trimmed
+
+# Function to report the token count of each prompt component
+def token_report(messages, components, trimmed=(), model="gpt-4", max_tokens=None):
+    system_tokens = sum(count_tokens(m["content"], model) for m in messages if m["role"] == "system")
+    user_tokens = sum(count_tokens(m["content"], model) for m in messages if m["role"] != "system")
+    component_tokens = {name: count_tokens(text, model) for name, text in components.items() if text}
+    component_tokens['instructions'] = max(0, user_tokens - sum(component_tokens.values()))
+    total = count_message_tokens(messages, model)
+    return {
+        'system': system_tokens,
+        'user': user_tokens,
+        'total': total,
+        'components': component_tokens,
+        'trimmed': list(trimmed),
+        'budget': max_tokens,
+        'over_budget': max_tokens is not None and total > max_tokens,
+    }